@@ -0,0 +1,54 @@
+'''
+Compare the original per-slot find_all() path with the single read scan engine.
+Runs outside of ST using the stand-ins in this dir.
+
+    python bench/bench_scan.py [size_mb]
+'''
+import sys
+import re
+import timeit
+
+import harness
+import sublime
+
+
+#-----------------------------------------------------------------------------------
+def legacy_highlight_view(view, hl_vals):
+    ''' The original implementation: one find_all() over the whole buffer per slot. '''
+    for hl_index, tparams in hl_vals.items():
+        token = tparams['token']
+        if tparams['whole_word']:
+            regions = view.find_all(r'\b%s\b' % re.escape(token))
+        else:
+            regions = view.find_all(token, sublime.LITERAL)
+        if len(regions) > 0:
+            view.add_regions(f'region_user_hl{int(hl_index) + 1}', regions)
+
+
+#-----------------------------------------------------------------------------------
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    hlp = harness.load_plugin()
+    # Keep on the plain one pass path.
+    harness.set_setting('chunk_threshold', 1 << 40)
+    text = harness.make_text(int(size_mb * 1024 * 1024))
+    slots = harness.make_slots(len(harness.TOKENS))
+
+    # Same answers?
+    v1 = harness.make_view(text)
+    v2 = harness.make_view(text)
+    legacy_highlight_view(v1, slots)
+    hlp._highlight_view(v2, slots)
+    harness.run_timeouts()
+    for key in [f'region_user_hl{i + 1}' for i in range(len(slots))]:
+        if v1.get_regions(key) != v2.get_regions(key):
+            print(f'Mismatch in {key}')
+
+    print(f'{len(text) / 1e6:.1f} MB, {len(slots)} slots')
+    for name, func in [('per slot find_all', legacy_highlight_view), ('scan engine', hlp._highlight_view)]:
+        secs = min(timeit.repeat(lambda: (func(harness.make_view(text), slots), harness.run_timeouts()), number=1, repeat=3))
+        print(f'{name:20} {secs * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
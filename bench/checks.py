@@ -0,0 +1,367 @@
+'''
+Regression checks for plugin paths the benchmarks don't go through. Runs outside of ST using the stand-ins in this dir.
+
+    python bench/checks.py
+'''
+import os
+import sys
+import tempfile
+import time
+
+import harness
+import sublime
+
+
+#-----------------------------------------------------------------------------------
+def region_name(hlp, iind):
+    ''' Where the regions of slot iind go. '''
+    return hlp.sc.get_highlight_info('user')[iind].region_name
+
+
+#-----------------------------------------------------------------------------------
+def check_flush_fallback(hlp):
+    ''' Edits all over the file are rehighlighted with a full rescan. '''
+    win = sublime.Window()
+    sublime._windows.append(win)
+    fn = '/bench/check/flush.txt'
+    view = sublime.View(harness.make_text(100000), fn, win)
+    win._views.append(view)
+    hlp._hls[fn] = {'0': {'token': 'ERROR', 'whole_word': False}}
+
+    listener = hlp.HighlightTextChangeListener()
+    listener.buffer = view.buffer()
+    # More separate spans than an incremental flush takes.
+    for i in range(hlp._incremental_max_spans + 8):
+        view.replace(sublime.Region(i * 2000), 'ERROR')
+        listener._add_change(i * 2000, i * 2000, 5)
+    listener._flush(listener._gen)
+    harness.run_timeouts()
+
+    expected = len(view.find_all('ERROR', sublime.LITERAL))
+    found = len(view.get_regions(region_name(hlp, 0)))
+    assert found == expected, f'flush fallback found {found} of {expected}'
+
+
+#-----------------------------------------------------------------------------------
+def check_regex_windows(hlp):
+    ''' Regex slots scanned in windows find the same as one finditer(), including matches across the windows. '''
+    cases = [(harness.make_text(1 << 20), [r'n=\d+', r'\bti\w+', r'ERROR.*?timeout', r'\d\d:\d\d$', r'[^\n]{100}']),
+             # Longer than the windows, and $ and lookaheads near their ends.
+             (('ERROR ' + 'y' * 600 + '\n') * 300, [r'ERROR.*', r'ERROR y*$', r'y+(?=\n)', r'\by+\b', r'y{300}(?!y)']),
+             (('x' * 5000 + 'END\n') * 200, [r'x+', r'x+END', r'x+$', r'(?<=\n)x{4000}']),
+             # Empty matches are dropped.
+             (('ab ' * 1000 + '\n') * 100, [r'\b', r'(?=a)', r'a*', r'b?'])]
+    for text, tokens in cases:
+        for token in tokens:
+            matcher = hlp._Matcher({0: {'token': token, 'whole_word': False, 'regex': True}})
+            expected = [m.span() for m in matcher.slots[0][1].finditer(text) if m.end() > m.start()]
+            found = matcher.scan(text)[0]
+            assert found == expected, f'{token}: {len(found)} windowed, {len(expected)} in one go'
+
+
+#-----------------------------------------------------------------------------------
+def check_regex_budget(hlp):
+    ''' Slow regex slots are turned off in about their budget, with or without matches. '''
+    budget = hlp._regex_budget
+    hlp._regex_budget = 0.2
+    try:
+        # Backtracks on every line and never matches.
+        cases = [('(a|aa)+b', ('a' * 24 + '\n') * 2000),
+                 # A few hundred matches, each slow to find.
+                 ('(a|aa)+b', ('a' * 22 + '\nab\n') * 500)]
+        for token, text in cases:
+            matcher = hlp._Matcher({0: {'token': token, 'whole_word': False, 'regex': True}})
+            start = time.perf_counter()
+            matcher.scan(text)
+            secs = time.perf_counter() - start
+            assert matcher.failed == {0}, f'{token} not turned off after {secs:.2f} sec'
+            assert secs < 1.0, f'{token} took {secs:.2f} sec'
+    finally:
+        hlp._regex_budget = budget
+
+
+#-----------------------------------------------------------------------------------
+def check_chunked_budget(hlp):
+    ''' A regex slot turned off in the visible part of a big view doesn't stop the rest being scanned. '''
+    win = sublime.Window()
+    sublime._windows.append(win)
+    fn = '/bench/check/slow.txt'
+    view = sublime.View(('a' * 24 + ' ' + 'x' * 40 + ' ERROR\n') * 60000, fn, win)
+    win._views.append(view)
+    assert hlp._use_chunks(view)
+    slots = {'0': {'token': 'ERROR', 'whole_word': False}, '1': {'token': '(a|aa)+b', 'whole_word': False, 'regex': True}}
+    hlp._hls[fn] = slots
+
+    budget = hlp._regex_budget
+    hlp._regex_budget = 0.05
+    try:
+        hlp._highlight_view(view, {int(k): v for k, v in slots.items()})
+        harness.run_timeouts()
+    finally:
+        hlp._regex_budget = budget
+
+    found = len(view.get_regions(region_name(hlp, 0)))
+    assert found == 60000, f'{found} regions after the regex slot was turned off'
+    assert slots['1'].get('disabled'), 'slow slot not turned off'
+
+
+#-----------------------------------------------------------------------------------
+def check_empty_regex(hlp):
+    ''' Regexes that only match empty text are refused, the empty matches of the others are skipped. '''
+    win = sublime.Window()
+    sublime._windows.append(win)
+    fn = '/bench/check/empty.txt'
+    text = 'ab xx a xxx b\n' * 1000
+    view = sublime.View(text, fn, win)
+    win._views.append(view)
+    cmd = hlp.SbotHighlightTextCommand(view)
+
+    for token in [r'\b', r'(?=x)', r'(?<=a)', r'$']:
+        cmd._set_token(0, token, False, True, False)
+        harness.run_timeouts()
+        assert '0' not in hlp._hls.get(fn, {}), f'{token} taken'
+
+    cmd._set_token(0, 'x*', False, True, False)
+    harness.run_timeouts()
+    regions = view.get_regions(region_name(hlp, 0))
+    assert len(regions) == 2000 and all(r.b > r.a for r in regions), f'{len(regions)} regions'
+
+
+#-----------------------------------------------------------------------------------
+def check_search_budget(hlp):
+    ''' Project search turns off slow regex tokens like the views do and finds the rest. '''
+    tmp = tempfile.mkdtemp()
+    for i in range(4):
+        with open(os.path.join(tmp, f'f{i}.log'), 'w') as fp:
+            fp.write(('a' * 24 + ' foo\n') * 2000)
+
+    class Results:
+        text = []
+
+        def run_command(self, cmd, args):
+            self.text.append(args['characters'])
+
+    tokens = [{'token': 'foo', 'whole_word': True}, {'token': '(a|aa)+b', 'whole_word': False, 'regex': True},
+              {'token': 'fo+', 'whole_word': False, 'regex': True}]
+    patterns = [(tparams['token'], hlp._search_pattern(tparams), tparams.get('regex')) for tparams in tokens]
+    budget = hlp._regex_budget
+    hlp._regex_budget = 0.2
+    start = time.perf_counter()
+    try:
+        hlp._search_folders(hlp._search_gen, Results(), [tmp], patterns, [], [], 1 << 20)
+        harness.run_timeouts()
+    finally:
+        hlp._regex_budget = budget
+    secs = time.perf_counter() - start
+
+    text = ''.join(Results.text)
+    assert '16000 hits in 4 files' in text and 'skipped (a|aa)+b\n' in text, text[-200:]
+    assert secs < 2.0, f'search took {secs:.2f} sec'
+
+
+#-----------------------------------------------------------------------------------
+def check_chunked_progress(hlp):
+    ''' Big views put up all the regions once at the end, and only the visible part while scanning. '''
+    win = sublime.Window()
+    sublime._windows.append(win)
+    view = sublime.View(harness.make_text(8 << 20), '/bench/check/progress.txt', win)
+    win._views.append(view)
+    assert hlp._use_chunks(view)
+
+    posted = []
+    post_hits = hlp._post_hits
+    hlp._post_hits = lambda view, gen, cc, hits, *args, **kwargs: (posted.append(sum(len(h) for h in hits.values()))
+                                                                   or post_hits(view, gen, cc, hits, *args, **kwargs))
+    set_timeout_async = hlp.sublime.set_timeout_async
+    slices = []
+
+    def scroll(callback, delay=0):
+        def run():
+            slices.append(1)
+            if len(slices) == 3:
+                # Scrolled to the middle while scanning.
+                view._top = view.size() // 2
+            callback()
+        set_timeout_async(run, delay)
+
+    hlp.sublime.set_timeout_async = scroll
+    try:
+        hlp._highlight_view(view, {0: {'token': 'ERROR', 'whole_word': False}})
+        harness.run_timeouts()
+    finally:
+        hlp._post_hits = post_hits
+        hlp.sublime.set_timeout_async = set_timeout_async
+
+    expected = len(view.find_all('ERROR', sublime.LITERAL))
+    assert len(posted) == 3 and max(posted[:2]) < 1000 and posted[2] == expected, posted
+
+
+#-----------------------------------------------------------------------------------
+def check_match_cache(hlp):
+    ''' The match cache only reads the content when the rest of the key matches and doesn't write on hits. '''
+    store = hlp.sbot_store
+    tmp = tempfile.mkdtemp()
+    cache = store.MatchCache(os.path.join(tmp, 'check.store'))
+    fn = os.path.join(tmp, 'file.txt')
+    with open(fn, 'w') as fp:
+        fp.write('ERROR one ERROR two')
+    slots = {'0': {'token': 'ERROR', 'whole_word': False}}
+    hits = {0: [(0, 5), (10, 15)]}
+
+    hashed = []
+    content_hash = store.content_hash
+    store.content_hash = lambda fn: hashed.append(fn) or content_hash(fn)
+    saved = []
+    atomic_write = store._atomic_write
+    store._atomic_write = lambda fn, data: (fn == cache.index_fn and saved.append(fn)) or atomic_write(fn, data)
+    try:
+        key = store.file_key(fn, slots)
+        cache.put(fn, key, hits, 1 << 20)
+        assert cache.get(fn, key) == hits, 'no hit for the same key'
+        assert len(hashed) == 2 and len(saved) == 1, f'{len(hashed)} hashes, {len(saved)} index writes'
+
+        # Different tokens or stat - no need to read the file.
+        assert cache.get(fn, store.file_key(fn, {'0': {'token': 'two', 'whole_word': False}})) is None
+        with open(fn, 'w') as fp:
+            fp.write('ERROR one ERROR three')
+        assert cache.get(fn, store.file_key(fn, slots)) is None
+        assert len(hashed) == 2 and len(saved) == 1, f'{len(hashed)} hashes, {len(saved)} index writes'
+
+        # Same stat, different content.
+        with open(fn, 'w') as fp:
+            fp.write('ERROR one ERROR six')
+        os.utime(fn, ns=(key[2], key[2]))
+        assert store.file_key(fn, slots) == key and cache.get(fn, key) is None
+        assert len(hashed) == 3, f'{len(hashed)} hashes'
+
+        # Too big to keep, found out without encoding it.
+        cache.put(fn, key, {0: [(i, i + 1) for i in range(1000)]}, 1000)
+        assert cache.get(fn, key) is None and len(hashed) == 4 and len(saved) == 1
+    finally:
+        store.content_hash = content_hash
+        store._atomic_write = atomic_write
+
+    # Another instance's entries are kept.
+    other = store.MatchCache(os.path.join(tmp, 'check.store'))
+    for i in range(3):
+        fn_i = os.path.join(tmp, f'file{i}.txt')
+        with open(fn_i, 'w') as fp:
+            fp.write('ERROR')
+        (cache if i % 2 else other).put(fn_i, store.file_key(fn_i, slots), {0: [(0, 5)]}, 1 << 20)
+    entries = [name for name in os.listdir(cache.cache_dir) if name.endswith('.json') and name != 'index.json']
+    count, size = cache.sizes()
+    assert count == len(entries) == 4, f'{count} entries in the index, {len(entries)} files'
+    assert size == sum(os.path.getsize(os.path.join(cache.cache_dir, name)) for name in entries)
+
+
+#-----------------------------------------------------------------------------------
+def check_cache_errors(hlp):
+    ''' Failing to write the match cache still shows the regions. '''
+    store = hlp.sbot_store
+    tmp = tempfile.mkdtemp()
+    cache = store.MatchCache(os.path.join(tmp, 'check.store'))
+    fn = os.path.join(tmp, 'locked.txt')
+    text = harness.make_text(100000)
+    with open(fn, 'w') as fp:
+        fp.write(text)
+    win = sublime.Window()
+    sublime._windows.append(win)
+    view = sublime.View(text, fn, win)
+    win._views.append(view)
+    slots = {0: {'token': 'ERROR', 'whole_word': False}}
+
+    def locked(fn, data):
+        raise PermissionError(13, 'Locked', fn)
+
+    atomic_write = store._atomic_write
+    store._atomic_write = locked
+    try:
+        key = store.file_key(fn, slots)
+        hlp._highlight_view(view, slots, on_done=lambda hits: cache.put(fn, key, hits, 1 << 20))
+        harness.run_timeouts()
+    finally:
+        store._atomic_write = atomic_write
+
+    expected = len(view.find_all('ERROR', sublime.LITERAL))
+    found = len(view.get_regions(region_name(hlp, 0)))
+    assert expected > 0 and found == expected, f'{found} of {expected} regions'
+    assert cache.get(fn, key) is None
+
+
+#-----------------------------------------------------------------------------------
+def check_chunked_cache(hlp):
+    ''' Big views show the visible part before going to the match cache. '''
+    win = sublime.Window()
+    sublime._windows.append(win)
+    view = sublime.View(harness.make_text(4 << 20), '/bench/check/chunked.txt', win)
+    win._views.append(view)
+    assert hlp._use_chunks(view)
+
+    order = []
+    post_hits = hlp._post_hits
+    hlp._post_hits = lambda *args, **kwargs: order.append('post') or post_hits(*args, **kwargs)
+    try:
+        hits = {0: [(r.a, r.b) for r in view.find_all('ERROR', sublime.LITERAL)]}
+        hlp._highlight_view(view, {0: {'token': 'ERROR', 'whole_word': False}},
+                            cached=lambda: order.append('cached') or hits)
+        harness.run_timeouts()
+    finally:
+        hlp._post_hits = post_hits
+
+    assert order == ['post', 'cached', 'post'], order
+    found = len(view.get_regions(region_name(hlp, 0)))
+    assert found == len(hits[0]), f'{found} regions for {len(hits[0])} cached hits'
+
+
+#-----------------------------------------------------------------------------------
+def check_exit_save(hlp):
+    ''' Changes taken by an autosave that hasn't run yet are written on exit. '''
+    sublime._windows.append(sublime.Window(['/bench/exit']))
+    fn = '/bench/exit/changed.txt'
+    hlp._hls[fn] = {'0': {'token': 'ERROR', 'whole_word': False}}
+    hlp._access[fn] = 1
+    hlp._dirty.add(fn)
+
+    # Taken on the UI thread, the write on the async thread is still queued.
+    hlp._autosave(hlp._save_gen)
+    assert len(hlp._dirty) == 0 and len(hlp._unsynced) > 0
+    hlp.HighlightEvent()._write_store()
+    hls, _ = hlp.sbot_store.HighlightStore(hlp.sc.get_store_fn()).load(['/bench/exit'])
+    assert hls.get(fn) == hlp._hls[fn], 'lost on exit'
+    # Then the queued one has nothing left to do.
+    harness.run_timeouts()
+    assert len(hlp._unsynced) == 0
+
+
+#-----------------------------------------------------------------------------------
+def check_store_memo(hlp):
+    ''' The store only remembers where the highlighted files go, not every file opened. '''
+    tmp = tempfile.mkdtemp()
+    store = hlp.sbot_store.HighlightStore(os.path.join(tmp, 'check.store'))
+    folder = os.path.join(tmp, 'project')
+    store.load([folder])
+    records = [hlp.sbot_store.make_record(os.path.join(folder, f'f{i}.txt'), {'0': {'token': 'x'}}, 1) for i in range(3)]
+    access = {record['fn']: 1 for record in records}
+    store.sync(records, access)
+
+    for i in range(1000):
+        store.load_file(os.path.join(folder, 'sub', f'o{i}.txt'))
+        store.shard_of(os.path.join(folder, f'o{i}.txt'))
+    assert len(store._found) <= len(access), f'{len(store._found)} remembered'
+    store.sync([], access)
+    assert sorted(store._found) == sorted(access), sorted(store._found)
+
+
+#-----------------------------------------------------------------------------------
+def main():
+    hlp = harness.load_plugin()
+    checks = [check_flush_fallback, check_regex_windows, check_regex_budget, check_chunked_budget, check_chunked_progress,
+              check_match_cache, check_cache_errors, check_chunked_cache, check_exit_save,
+              check_store_memo, check_search_budget, check_empty_regex]
+    for check in checks:
+        check(hlp)
+        print(f'{check.__name__}: ok')
+
+
+if __name__ == '__main__':
+    main()
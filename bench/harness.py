@@ -0,0 +1,93 @@
+'''
+Shared setup for the benchmarks. Loads the plugin against the stand-ins in this dir and makes test data.
+'''
+import sys
+import os
+import random
+import importlib
+import types
+
+# The stand-ins must win over anything else called sublime.
+_bench_dir = os.path.dirname(os.path.abspath(__file__))
+if sys.path[0] != _bench_dir:
+    sys.path.insert(0, _bench_dir)
+
+import sublime
+
+
+# Words the generated text is made of.
+WORDS = ['INFO', 'DEBUG', 'ERROR', 'WARN', 'connection', 'timeout', 'user', 'request', 'id=', 'session', 'retry']
+
+# Slots to use, in order. Mix of plain and whole word.
+TOKENS = [
+    {'token': 'ERROR', 'whole_word': False},
+    {'token': 'timeout', 'whole_word': True},
+    {'token': 'session', 'whole_word': True},
+    {'token': 'n=4242', 'whole_word': False},
+    {'token': 'retry', 'whole_word': True},
+    {'token': 'id=', 'whole_word': True},
+]
+
+
+#-----------------------------------------------------------------------------------
+def load_plugin():
+    ''' Import the plugin as a package with the stand-ins installed. Returns the sbot_highlight module. '''
+    if 'hltoken' not in sys.modules:
+        pkg = types.ModuleType('hltoken')
+        pkg.__path__ = [os.path.dirname(_bench_dir)]
+        sys.modules['hltoken'] = pkg
+    return importlib.import_module('hltoken.sbot_highlight')
+
+
+#-----------------------------------------------------------------------------------
+def set_setting(name, value):
+    ''' Override one of the plugin settings. '''
+    plugin = sys.modules['hltoken.sbot_common']
+    sublime.load_settings(plugin.get_settings_fn()).set(name, value)
+
+
+#-----------------------------------------------------------------------------------
+def make_text(size):
+    ''' Something log like, size chars. Big ones repeat a 1 MB block so they don't take forever to make. '''
+    rnd = random.Random(42)
+    block_size = min(size, 1 << 20)
+    lines = []
+    total = 0
+    i = 0
+    while total < block_size:
+        line = f'2024-01-01 12:00:{i % 60:02d} ' + ' '.join(rnd.choice(WORDS) for _ in range(8)) + f' n={i}'
+        lines.append(line)
+        total += len(line) + 1
+        i += 1
+    block = '\n'.join(lines) + '\n'
+    return (block * (size // len(block) + 1))[:size]
+
+
+#-----------------------------------------------------------------------------------
+def make_hl_vals(count):
+    ''' The first count slots as they are in the store. '''
+    return {str(i): dict(TOKENS[i]) for i in range(count)}
+
+
+#-----------------------------------------------------------------------------------
+def make_slots(count):
+    ''' The first count slots as the scans take them. '''
+    return {i: dict(TOKENS[i]) for i in range(count)}
+
+
+#-----------------------------------------------------------------------------------
+def make_store_hls(entries):
+    ''' A store collection of entries files, each with a few slots. '''
+    return {f'/bench/project/dir{i % 50}/file{i}.txt': make_hl_vals(1 + i % len(TOKENS)) for i in range(entries)}
+
+
+#-----------------------------------------------------------------------------------
+def make_view(text, fn='/bench/file.txt'):
+    ''' New view on text. '''
+    return sublime.View(text, fn)
+
+
+#-----------------------------------------------------------------------------------
+def run_timeouts():
+    ''' Do everything the plugin queued with set_timeout(). '''
+    sublime.run_timeouts()
@@ -0,0 +1,196 @@
+'''
+Time the plugin hot paths outside of ST and print a table that can be compared between revisions.
+
+    python bench/run_bench.py [--full] [--sizes 1k,1m,...] [--tokens 1,3,6] [--entries 100,1000,...] [--repeat N] [--out fn]
+
+highlight   _highlight_view() on a generated file, including applying the regions.
+read_store  HighlightEvent._read_store() of a store with that many files, all in the open project.
+write_store HighlightEvent._write_store() of the same, all changed since the last save.
+render      _render_scopes() of that many scopes, with nothing remembered and then again.
+startup     Plugin import, plugin_loaded() and on_init() in a fresh interpreter.
+'''
+import sys
+import os
+import time
+import argparse
+import subprocess
+import statistics
+
+import harness
+import sublime
+
+
+# Default file sizes. --full does the lot.
+_sizes = '1k,10k,100k,1m,10m'
+_full_sizes = '1k,10k,100k,1m,10m,100m,500m'
+
+_units = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+
+
+#-----------------------------------------------------------------------------------
+def parse_size(s):
+    ''' 1k, 20m etc. '''
+    s = s.strip().lower()
+    if s[-1] in _units:
+        return int(float(s[:-1]) * _units[s[-1]])
+    return int(s)
+
+
+#-----------------------------------------------------------------------------------
+def format_size(n):
+    for unit, mult in [('g', 1 << 30), ('m', 1 << 20), ('k', 1 << 10)]:
+        if n >= mult and n % mult == 0:
+            return f'{n // mult}{unit}'
+    return str(n)
+
+
+#-----------------------------------------------------------------------------------
+def timed(func, setup, repeat):
+    ''' Run setup() then time func(arg) repeat times. Returns list of secs. '''
+    times = []
+    for _ in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        func(arg)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+#-----------------------------------------------------------------------------------
+def bench_highlight(hlp, sizes, token_counts, repeat):
+    rows = []
+    for size in sizes:
+        text = harness.make_text(size)
+        # Big ones take a while, no need to do them over and over.
+        reps = repeat if size < (100 << 20) else 1
+        for count in token_counts:
+            slots = harness.make_slots(count)
+
+            def run(view):
+                hlp._highlight_view(view, slots)
+                harness.run_timeouts()
+
+            times = timed(run, lambda: harness.make_view(text), reps)
+            rate = size / min(times) / (1 << 20)
+            rows.append(('highlight', f'size={format_size(size)} tokens={count}', times, f'{rate:.1f} MB/s'))
+        del text
+    return rows
+
+
+#-----------------------------------------------------------------------------------
+def bench_store(hlp, entry_counts, repeat):
+    rows = []
+    event = hlp.HighlightEvent()
+    # Existence checks are background work, not part of reading.
+    hlp._validate_store = lambda fns: None
+    # Nor is eviction, and the bigger cases are over the default limit.
+    hlp._evict_store = lambda: None
+
+    # The files are all in one project, open so its shard is the one read.
+    sublime._windows.append(sublime.Window(['/bench/project']))
+
+    for entries in entry_counts:
+        hls = harness.make_store_hls(entries)
+
+        def set_hls():
+            # As if they were all changed since the last save.
+            hlp._hls.clear()
+            hlp._hls.update(hls)
+            hlp._dirty.update(hls)
+
+        times = timed(lambda _: event._write_store(), set_hls, repeat)
+        store_bytes = hlp._get_store().sizes()[2]
+        rows.append(('write_store', f'entries={entries}', times, f'{store_bytes / 1024:.0f} KB'))
+
+        times = timed(lambda _: event._read_store(), lambda: None, repeat)
+        if len(hlp._hls) != entries:
+            print(f'read_store entries={entries}: got {len(hlp._hls)}')
+        rows.append(('read_store', f'entries={entries}', times, f'{store_bytes / 1024:.0f} KB'))
+    return rows
+
+
+#-----------------------------------------------------------------------------------
+def bench_render(hlp, scope_counts, repeat):
+    rows = []
+    all_scopes = hlp._notr_scopes + hlp._markup_scopes + hlp._internal_scopes + hlp._syntax_scopes + hlp._generic_colors_scopes
+    for count in scope_counts:
+        scopes = (all_scopes * (count // len(all_scopes) + 1))[:count]
+
+        def cold():
+            # Nothing remembered from the runs before, as after a color scheme change.
+            hlp._styles.clear()
+            hlp._scope_parts.clear()
+            hlp._scope_popups.clear()
+            return harness.make_view('')
+
+        times = timed(lambda view: hlp._render_scopes(scopes, view), cold, repeat)
+        rows.append(('render', f'scopes={count}', times, ''))
+        times = timed(lambda view: hlp._render_scopes(scopes, view), lambda: harness.make_view(''), repeat)
+        rows.append(('render', f'scopes={count} warm', times, ''))
+    return rows
+
+
+#-----------------------------------------------------------------------------------
+def bench_startup(repeat):
+    ''' Each run is a new interpreter so nothing is already imported. '''
+    code = '''
+import harness, sublime
+hlp = harness.load_plugin()
+hlp.plugin_loaded()
+view = sublime.View('text', '/bench/file.txt', sublime.Window())
+hlp.HighlightEvent().on_init([view])
+print(' '.join(f'{stat.op}={stat.msecs}' for stat in hlp._startup_stats))
+'''
+    times = {}
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+        for item in out.split():
+            op, msecs = item.split('=')
+            times.setdefault(op, []).append(float(msecs) / 1000)
+    return [('startup', op, secs, '') for op, secs in times.items()]
+
+
+#-----------------------------------------------------------------------------------
+def print_table(rows, fp):
+    fp.write(f'{"operation":12} {"case":28} {"best ms":>10} {"mean ms":>10}  {"info"}\n')
+    fp.write(f'{"-" * 12} {"-" * 28} {"-" * 10} {"-" * 10}  {"-" * 12}\n')
+    for op, case, times, info in rows:
+        fp.write(f'{op:12} {case:28} {min(times) * 1000:10.2f} {statistics.mean(times) * 1000:10.2f}  {info}\n')
+
+
+#-----------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Plugin benchmarks')
+    parser.add_argument('--full', action='store_true', help=f'sizes {_full_sizes}')
+    parser.add_argument('--sizes', default=None, help=f'file sizes, default {_sizes}')
+    parser.add_argument('--tokens', default='1,3,6', help='token counts')
+    parser.add_argument('--entries', default='100,1000,10000', help='store sizes')
+    parser.add_argument('--scopes', default='10,100,1000', help='scope counts for render')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, best is reported')
+    parser.add_argument('--out', default=None, help='also write the table here')
+    args = parser.parse_args()
+
+    sizes = args.sizes if args.sizes is not None else (_full_sizes if args.full else _sizes)
+    sizes = [parse_size(s) for s in sizes.split(',')]
+    token_counts = [int(s) for s in args.tokens.split(',')]
+    entry_counts = [int(s) for s in args.entries.split(',')]
+    scope_counts = [int(s) for s in args.scopes.split(',')]
+
+    hlp = harness.load_plugin()
+
+    rows = []
+    rows.extend(bench_highlight(hlp, sizes, token_counts, args.repeat))
+    rows.extend(bench_store(hlp, entry_counts, args.repeat))
+    rows.extend(bench_render(hlp, scope_counts, args.repeat))
+    rows.extend(bench_startup(args.repeat))
+
+    print(f'python {sys.version.split()[0]}, {sys.platform}')
+    print_table(rows, sys.stdout)
+    if args.out is not None:
+        with open(args.out, 'w') as fp:
+            print_table(rows, fp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+'''
+Stand-in for the ST sublime module so the plugin can be imported and timed outside of ST.
+Only what the plugin uses, and only as much behavior as the benchmarks need.
+'''
+import os
+import re
+import json
+import tempfile
+
+
+LITERAL = 1
+IGNORECASE = 2
+
+# Where the plugin keeps its files. Fresh for each run.
+_packages_path = tempfile.mkdtemp(prefix='sbot_bench_')
+
+# Callbacks from set_timeout() and set_timeout_async(). run_timeouts() does the ones with no delay in order,
+# run_delayed() the others. Debounces and polls would otherwise go round forever.
+_timeouts = []
+_delayed = []
+
+# Settings files by name.
+_settings = {}
+
+
+#-----------------------------------------------------------------------------------
+class Region:
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def empty(self):
+        return self.a == self.b
+
+    def size(self):
+        return abs(self.b - self.a)
+
+    def __len__(self):
+        return self.size()
+
+    def __eq__(self, other):
+        return (self.a, self.b) == (other.a, other.b)
+
+    def __repr__(self):
+        return f'Region({self.a}, {self.b})'
+
+
+#-----------------------------------------------------------------------------------
+class Settings:
+    def __init__(self, values=None):
+        self._values = values if values is not None else {}
+
+    def get(self, name, default=None):
+        return self._values.get(name, default)
+
+    def set(self, name, value):
+        self._values[name] = value
+
+    def add_on_change(self, tag, callback):
+        pass
+
+    def clear_on_change(self, tag):
+        pass
+
+
+#-----------------------------------------------------------------------------------
+class Selection(list):
+    def add(self, region):
+        self.append(region)
+
+
+#-----------------------------------------------------------------------------------
+class Buffer:
+    ''' One per View here, no clones. '''
+    def __init__(self, view):
+        self._view = view
+
+    def id(self):
+        return self._view.buffer_id()
+
+    def file_name(self):
+        return self._view.file_name()
+
+    def views(self):
+        return [self._view] if self._view.is_valid() else []
+
+    def primary_view(self):
+        return self._view if self._view.is_valid() else None
+
+
+#-----------------------------------------------------------------------------------
+class View:
+    ''' Text held in a str. find_all() is emulated with re. '''
+    _next_id = 1
+
+    def __init__(self, text='', file_name=None, window=None):
+        self._id = View._next_id
+        View._next_id += 1
+        self._text = text
+        self._file_name = file_name
+        self._window = window
+        self._regions = {}
+        self._change_count = 0
+        self._valid = True
+        self._sel = Selection([Region(0)])
+        self._settings = Settings()
+
+    def id(self):
+        return self._id
+
+    def buffer_id(self):
+        return self._id
+
+    def buffer(self):
+        return Buffer(self)
+
+    def window(self):
+        return self._window
+
+    def file_name(self):
+        return self._file_name
+
+    def is_scratch(self):
+        return False
+
+    def is_dirty(self):
+        return False
+
+    def is_loading(self):
+        return False
+
+    def is_valid(self):
+        return self._valid
+
+    def close(self):
+        self._valid = False
+
+    def change_count(self):
+        return self._change_count
+
+    def settings(self):
+        return self._settings
+
+    def syntax(self):
+        return None
+
+    def sel(self):
+        return self._sel
+
+    def size(self):
+        return len(self._text)
+
+    def substr(self, region):
+        if isinstance(region, int):
+            return self._text[region:region + 1]
+        return self._text[region.begin():region.end()]
+
+    def replace(self, region, text):
+        ''' Stand-in for an edit. Regions are not adjusted. '''
+        self._text = self._text[:region.begin()] + text + self._text[region.end():]
+        self._change_count += 1
+
+    def line(self, region):
+        if isinstance(region, int):
+            region = Region(region)
+        a = self._text.rfind('\n', 0, region.begin()) + 1
+        b = self._text.find('\n', region.end())
+        return Region(a, len(self._text) if b < 0 else b)
+
+    def full_line(self, region):
+        line = self.line(region)
+        return Region(line.a, min(len(self._text), line.b + 1))
+
+    def word(self, region):
+        pt = region.begin() if isinstance(region, Region) else region
+        a = pt
+        while a > 0 and (self._text[a - 1].isalnum() or self._text[a - 1] == '_'):
+            a -= 1
+        b = pt
+        while b < len(self._text) and (self._text[b].isalnum() or self._text[b] == '_'):
+            b += 1
+        return Region(a, b)
+
+    def visible_region(self):
+        # About a screen full.
+        a = min(getattr(self, '_top', 0), len(self._text))
+        return Region(a, min(len(self._text), a + 5000))
+
+    def show(self, pt, show_surrounds=True):
+        ''' Scroll so pt is at the top. '''
+        self._top = pt if isinstance(pt, int) else pt.begin()
+
+    def find_all(self, pattern, flags=0):
+        if flags & LITERAL:
+            pattern = re.escape(pattern)
+        return [Region(m.start(), m.end()) for m in re.finditer(pattern, self._text, re.I if flags & IGNORECASE else 0)]
+
+    def add_regions(self, key, regions, scope='', icon='', flags=0):
+        self._regions[key] = list(regions)
+
+    def get_regions(self, key):
+        return list(self._regions.get(key, []))
+
+    def erase_regions(self, key):
+        self._regions.pop(key, None)
+
+    def style_for_scope(self, scope):
+        # Something plausible and stable.
+        return {'foreground': '#c0c0c0', 'background': '#202020', 'bold': False, 'italic': False}
+
+    def scope_name(self, pt):
+        return 'text.plain '
+
+    def show_popup(self, content, flags=0, location=-1, max_width=320, max_height=240, on_navigate=None, on_hide=None):
+        self.popup = content
+
+    def hide_popup(self):
+        pass
+
+    def set_status(self, key, value):
+        pass
+
+    def erase_status(self, key):
+        pass
+
+    def run_command(self, cmd, args=None):
+        if cmd == 'append':
+            self._text += args['characters']
+
+    def set_scratch(self, scratch):
+        pass
+
+
+#-----------------------------------------------------------------------------------
+class Window:
+    def __init__(self, folders=None):
+        self._views = []
+        self._folders = folders if folders is not None else []
+
+    def views(self):
+        return self._views
+
+    def active_view(self):
+        return self._views[-1] if len(self._views) > 0 else None
+
+    def folders(self):
+        return self._folders
+
+    def project_file_name(self):
+        return None
+
+    def new_file(self):
+        view = View(window=self)
+        self._views.append(view)
+        return view
+
+    def focus_view(self, view):
+        pass
+
+    def show_input_panel(self, caption, initial_text, on_done, on_change, on_cancel):
+        ''' As if the user just hit enter. '''
+        on_done(initial_text)
+
+
+#-----------------------------------------------------------------------------------
+def packages_path():
+    return _packages_path
+
+
+def platform():
+    return 'linux'
+
+
+def version():
+    return '4000'
+
+
+def load_settings(name):
+    ''' Defaults come from the package's own settings file if there is one. '''
+    if name not in _settings:
+        values = {}
+        fn = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), name)
+        if os.path.isfile(fn):
+            with open(fn) as fp:
+                text = fp.read()
+            # sublime-settings allows comments and trailing commas.
+            text = re.sub(r'^\s*//.*$', '', text, flags=re.MULTILINE)
+            text = re.sub(r',(\s*[}\]])', r'\1', text)
+            values = json.loads(text)
+        _settings[name] = Settings(values)
+    return _settings[name]
+
+
+def status_message(msg):
+    pass
+
+
+def error_message(msg):
+    print(f'error_message: {msg}')
+
+
+def message_dialog(msg):
+    print(f'message_dialog: {msg}')
+
+
+def set_clipboard(text):
+    pass
+
+
+# Bench code adds its windows here.
+_windows = []
+
+
+def windows():
+    return _windows
+
+
+def active_window():
+    return None
+
+
+def set_timeout(callback, delay=0):
+    (_delayed if delay > 0 else _timeouts).append(callback)
+
+
+def set_timeout_async(callback, delay=0):
+    (_delayed if delay > 0 else _timeouts).append(callback)
+
+
+def run_timeouts():
+    ''' Bench only. Run queued callbacks with no delay, including ones they queue, until there are none left. '''
+    while len(_timeouts) > 0:
+        _timeouts.pop(0)()
+
+
+def run_delayed():
+    ''' Bench only. Run the delayed callbacks queued so far, once, then the ones with no delay they queue. '''
+    delayed = _delayed[:]
+    del _delayed[:]
+    for callback in delayed:
+        callback()
+    run_timeouts()
@@ -0,0 +1,31 @@
+'''
+Stand-in for the ST sublime_plugin module. Just the base classes the plugin derives from.
+'''
+
+
+class EventListener:
+    pass
+
+
+class ViewEventListener:
+    def __init__(self, view=None):
+        self.view = view
+
+
+class TextChangeListener:
+    def __init__(self):
+        self.buffer = None
+
+
+class TextCommand:
+    def __init__(self, view=None):
+        self.view = view
+
+
+class WindowCommand:
+    def __init__(self, window=None):
+        self.window = window
+
+
+class ApplicationCommand:
+    pass
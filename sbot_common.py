@@ -3,9 +3,9 @@ import os
 import traceback
 import collections
 import datetime
-import pathlib
-import shutil
-import subprocess
+import threading
+import queue
+import time
 import sublime
 import sublime_plugin
 
@@ -19,9 +19,8 @@ HighlightInfo = collections.namedtuple('HighlightInfo', 'scope_name, region_name
 # Track temporary view.
 _temp_view_id = None
 
-# Plugin data storage dir.
-_store_path = os.path.join(sublime.packages_path(), 'User', _plugin_name)
-pathlib.Path(_store_path).mkdir(parents=True, exist_ok=True)
+# Plugin data storage dir. Made on first use, see get_store_path().
+_store_path = None
 
 
 #-----------------------------------------------------------------------------------
@@ -35,10 +34,21 @@ def get_plugin_name():
     return _plugin_name
 
 
+#-----------------------------------------------------------------------------------
+def get_store_path():
+    ''' Plugin data storage dir. Created the first time it's asked for rather than at import.'''
+    global _store_path
+    if _store_path is None:
+        path = os.path.join(sublime.packages_path(), 'User', _plugin_name)
+        os.makedirs(path, exist_ok=True)
+        _store_path = path
+    return _store_path
+
+
 #-----------------------------------------------------------------------------------
 def get_store_fn():
     ''' Where to keep this module's stuff.'''
-    return os.path.join(_store_path, f'{_plugin_name}.store')
+    return os.path.join(get_store_path(), f'{_plugin_name}.store')
 
 
 #-----------------------------------------------------------------------------------
@@ -203,6 +213,7 @@ def get_path_parts(window, paths):
 #-----------------------------------------------------------------------------------
 def open_path(path):
     '''Acts as if you had clicked the path in the UI. Honors your file associations.'''
+    import subprocess
     try:
         if sublime.platform() == 'osx':
             subprocess.call(['open', path])
@@ -218,6 +229,7 @@ def open_path(path):
 #-----------------------------------------------------------------------------------
 def open_terminal(where):
     '''Open a terminal in where.'''
+    import subprocess
 
     if sublime.platform() == 'osx':
         os.system(f'open -a Terminal {where}')
@@ -236,24 +248,46 @@ def open_terminal(where):
 #---------------------------- Logging functions ------------------------------------
 #-----------------------------------------------------------------------------------
 
-# Local log file.
-_log_fn = os.path.join(_store_path, f'{_plugin_name}.log')
+# Local log file. Set by the writer thread.
+_log_fn = None
+
+# Roll over when the log gets bigger than this. Keep this many old ones as _old1.log, _old2.log, ...
+_log_max_bytes = 50000
+_log_generations = 3
+
+# Levels in order. Records below _log_level are dropped right away.
+_log_levels = {'debug': 0, 'info': 1, 'warn': 2, 'error': 3}
+_log_level = 0
+
+# Records waiting for the writer thread: (level, secs, caller, message, tb text). Started on first use.
+_log_queue = queue.Queue()
+_log_thread = None
+_log_thread_lock = threading.Lock()
+
+# Most records the writer does in one go.
+_log_batch = 200
 
 
 #-----------------------------------------------------------------------------------
-# Initialize logging. Maybe roll over log now.
-if os.path.exists(_log_fn) and os.path.getsize(_log_fn) > 50000:
-    bup = _log_fn.replace('.log', '_old.log')
-    shutil.copyfile(_log_fn, bup)
-    # Clear current log file.
-    with open(_log_fn, 'w'):
-        pass
+def set_log_level(level):
+    '''Drop records below level: debug, info, warn, error.'''
+    global _log_level
+    _log_level = _log_levels.get(str(level).lower(), 0)
+
+
+#-----------------------------------------------------------------------------------
+def flush_log():
+    '''Wait until everything logged so far is in the file.'''
+    if _log_thread is not None:
+        _log_queue.join()
 
 
 #-----------------------------------------------------------------------------------
 def error(message, tb=None):
     '''Client logger function.'''
     _write_log('ERR', message, tb)
+    # Make sure it's there if ST goes down.
+    flush_log()
 
     # Show the user some context info.
     info = [message]
@@ -267,29 +301,29 @@ def error(message, tb=None):
 #-----------------------------------------------------------------------------------
 def warn(message):
     '''Client logger function.'''
-    _write_log('WRN', message)
+    if _log_level <= 2:
+        _write_log('WRN', message)
     sublime.message_dialog(f'Warning!\n{message}')
 
 
 #-----------------------------------------------------------------------------------
 def info(message):
     '''Client logger function.'''
-    _write_log('INF', message)
+    if _log_level <= 1:
+        _write_log('INF', message)
     sublime.status_message(message)
 
 
 #-----------------------------------------------------------------------------------
 def debug(message):
     '''Client logger function.'''
-    _write_log('DBG', message)
+    if _log_level <= 0:
+        _write_log('DBG', message)
 
 
 #-----------------------------------------------------------------------------------
 def _write_log(level, message, tb=None):
-    '''Format a standard message with caller info and log it.'''
-
-    # if _log_fn == INVALID_FN:
-    #     raise RuntimeError('Logger has not been initialized.')
+    '''Queue a standard message with caller info for the writer thread.'''
 
     # Sometimes get stray empty lines.
     if len(message) == 0:
@@ -297,27 +331,85 @@ def _write_log(level, message, tb=None):
     if len(message) == 1 and message[0] == '\n':
         return
 
-    # Get caller info.
+    # Get caller info. Has to be done here, the writer thread can't see it.
     frame = sys._getframe(2)
-    fn = os.path.basename(frame.f_code.co_filename)
-    line = frame.f_lineno
+    caller = f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno}'
     # f'func = {frame.f_code.co_name}'
     # f'mod_name = {frame.f_globals["__name__"]}'
     # f'class_name = {frame.f_locals["self"].__class__.__name__}'
 
-    time_str = f'{str(datetime.datetime.now())}'[0:-3]
-
-    # Write the record. No need to be synchronized across multiple sbot plugins
-    # as ST docs say that API runs on a single thread.
-    with open(_log_fn, 'a') as log:
-        out_line = f'{time_str} {level} {fn}:{line} {message}'
-        log.write(out_line + '\n')
-        if tb is not None:
-            # The traceback formatter is a bit ugly - clean it up.
-            tblines = []
-            for s in traceback.format_tb(tb):
-                if len(s) > 0:
-                    tblines.append(s[:-1])
-            stb = '\n'.join(tblines)
-            log.write(stb + '\n')
-        log.flush()
+    stb = None
+    if tb is not None:
+        # The traceback formatter is a bit ugly - clean it up.
+        tblines = []
+        for s in traceback.format_tb(tb):
+            if len(s) > 0:
+                tblines.append(s[:-1])
+        stb = '\n'.join(tblines)
+
+    _start_log_thread()
+    _log_queue.put((level, time.time(), caller, message, stb))
+
+
+#-----------------------------------------------------------------------------------
+def _start_log_thread():
+    '''First use.'''
+    global _log_thread
+    if _log_thread is None:
+        with _log_thread_lock:
+            if _log_thread is None:
+                _log_thread = threading.Thread(target=_log_writer, name=f'{_plugin_name} log', daemon=True)
+                _log_thread.start()
+
+
+#-----------------------------------------------------------------------------------
+def _log_writer():
+    '''Writer thread. Takes whatever is queued and writes it with one open.'''
+    global _log_fn
+    while True:
+        records = [_log_queue.get()]
+        while len(records) < _log_batch:
+            try:
+                records.append(_log_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        try:
+            lines = []
+            for level, secs, caller, message, stb in records:
+                time_str = f'{str(datetime.datetime.fromtimestamp(secs))}'[0:-3]
+                lines.append(f'{time_str} {level} {caller} {message}\n')
+                if stb is not None:
+                    lines.append(stb + '\n')
+            text = ''.join(lines)
+
+            if _log_fn is None:
+                _log_fn = os.path.join(get_store_path(), f'{_plugin_name}.log')
+            _roll_log(len(text))
+            with open(_log_fn, 'a') as log:
+                log.write(text)
+        except Exception as e:
+            # Nowhere to log it.
+            print(f'{_plugin_name} log write failed: {e}')
+        finally:
+            for _ in records:
+                _log_queue.task_done()
+
+
+#-----------------------------------------------------------------------------------
+def _roll_log(adding):
+    '''Shift the old logs along if adding would make the current one too big.'''
+    try:
+        size = os.path.getsize(_log_fn)
+    except OSError:
+        return
+    if size == 0 or size + adding <= _log_max_bytes:
+        return
+
+    def old_fn(n):
+        return _log_fn.replace('.log', f'_old{n}.log')
+
+    for n in range(_log_generations - 1, 0, -1):
+        if os.path.exists(old_fn(n)):
+            os.replace(old_fn(n), old_fn(n + 1))
+    os.replace(_log_fn, old_fn(1))
@@ -1,16 +1,170 @@
-import sys
+import time
+# Start of the import, for the startup report.
+_import_start = time.perf_counter()
 import os
 import re
-import json
+import sre_parse
+import bisect
+import itertools
+import collections
+import functools
+import hashlib
+import mmap
+import fnmatch
+import threading
 import sublime
 import sublime_plugin
 from . import sbot_common as sc
+from . import sbot_store
 
 
-# The current highlights. This is global across all ST instances/window/projects.
-# See Packages/User/HighlightToken/HighlightToken.store
+# The current highlights, of the store shards read so far. Those are the ones for the project folders open at
+# startup and any other file opened since. See Packages/User/HighlightToken/HighlightToken.index and .shards
 _hls = {}
 
+# Last time each file in _hls was used, secs since the epoch. The least recently used are evicted
+# when the store is over store_max_files or older than store_max_days.
+_access = {}
+
+# Eviction is picked on a worker. Don't start another while it's running.
+_evicting = False
+
+# Evict this much below store_max_files so each new file doesn't cost an eviction.
+_evict_slack = 0.1
+
+# Persistence for _hls. Created on first use.
+_store = None
+
+# Files in _hls changed since the last save.
+_dirty = set()
+
+# Journal records taken from _dirty but not written yet, oldest first. Only dropped once written so a save on
+# exit still has them. Writes hold _sync_lock so they go in order.
+_unsynced = []
+_unsynced_lock = threading.Lock()
+_sync_lock = threading.Lock()
+
+# Save this many msec after the last change. Bumping _save_gen cancels the scheduled one.
+_save_delay = 2000
+_save_gen = 0
+
+# Disk cache of scan results. Created on first use.
+_match_cache = None
+
+# Files known to exist while the store is being checked. These are never pruned. None when no check is running.
+_validated = None
+_validating = 0
+
+
+# Rehighlight edits after this many msec of no typing.
+_incremental_delay = 250
+
+# More separate edits than this before the flush does a full rescan instead.
+_incremental_max_spans = 32
+
+# Big views are scanned in chunks of between these many chars, sized from the scan rate to fit a slice.
+_chunk_min = 1 << 14
+_chunk_size = 1000000
+
+# Max time in sec for one slice of chunks before yielding the async thread.
+_slice_budget = 0.02
+
+# What is kept for each open buffer, key is buffer id. See _BufferState.
+_states = {}
+
+# Queued scans. Key is view id, value is the slots to do or None for all. Shared with the async thread.
+_pending = {}
+_sched_lock = threading.Lock()
+
+# Current project search. Bumping it cancels the running one.
+_search_gen = 0
+
+# Project search result line: file:line:col: [token] text
+_result_regex = r'^(.+?):(\d+):(\d+): '
+
+# Used to pick the whole word boundary test.
+_word_char = re.compile(r'\w')
+
+# For html export.
+_html_escapes = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+# Compiled slot patterns, most recently used last. Key is (token, flags), see _get_pattern().
+_patterns = collections.OrderedDict()
+_patterns_size = 64
+_patterns_lock = threading.Lock()
+
+# Compiled word lists for dictionary slots, most recently used last. They are slow to build.
+# Key is (file, size, mtime, flags), value is (pattern, longest word).
+_word_lists = collections.OrderedDict()
+_word_lists_size = 8
+
+# Mode bits in the _patterns key, next to the re flags.
+_WHOLE_WORD = 1 << 16
+_REGEX = 1 << 17
+
+# How long one regex slot may take in one scan, sec. Over that it's disabled.
+_regex_budget = 2.0
+
+# Regex slots are scanned in windows of this many chars so the budget is checked even when nothing matches.
+# They start small and grow while the pattern is quick.
+_regex_window_min = 256
+_regex_window_max = 1 << 16
+
+# Regex matches are assumed no longer than this when widening partial scans.
+_regex_max_len = 256
+
+# One timed operation. size is chars, or files for the store ops. counts is dict of HL number: matches, or None.
+_OpStat = collections.namedtuple('_OpStat', 'when, op, fn, size, msecs, counts')
+
+# Recent timed operations for sbot_highlight_stats. Oldest are dropped.
+_stats = collections.deque(maxlen=200)
+
+# Check the dense views for scrolling this often, msec. ST has no scroll event.
+_dense_poll_ms = 200
+_dense_polling = False
+
+# Most chars of the visible part scanned on its own, for dense slots and first in big views.
+_dense_visible_max = 100000
+
+# Status bar key for the match counts.
+_hits_status = 'highlight_token_hits'
+
+# Scope styles per color scheme: scheme: {scope: style}. Emptied when the scheme is changed or edited.
+_styles = {}
+
+# Scope popup parts per color scheme: scheme: {scope: (css, line)}. Emptied with _styles.
+_scope_parts = {}
+
+# Rendered scope popups, most recently used last. Key is (scheme, scopes), value is (html, text to copy).
+_scope_popups = collections.OrderedDict()
+_scope_popups_size = 32
+
+# Scope lists for sbot_all_scopes. Key is (Notr syntax, scopes_to_show).
+_all_scopes = {}
+
+# Preferences that pick the color scheme, and what they were last time.
+_scheme_prefs = ['color_scheme', 'dark_color_scheme', 'light_color_scheme']
+_last_schemes = None
+
+# Views refreshed per UI tick after a color scheme change.
+_reapply_batch = 10
+
+# Startup should take less than this many msec: module import, plugin_loaded() and on_init().
+_startup_budget_ms = 50
+
+# Startup ops. Not in _stats, they would get pushed out.
+_startup_stats = []
+
+# Running profile capture, see sbot_highlight_profile. None when off.
+_profile = None
+_profile_lock = threading.Lock()
+
+# Set in a thread while it is running a profiled call, so the profiled calls it makes aren't done again.
+_profile_local = threading.local()
+
+# Functions listed in each part of the profile summary.
+_profile_top = 25
+
 
 # Predefined scopes to display.
 _notr_scopes = [
@@ -55,18 +209,69 @@ _generic_colors_scopes = [
 #-----------------------------------------------------------------------------------
 def plugin_loaded():
     '''Called per plugin instance.'''
-    pass
+    global _last_schemes
+    start = time.perf_counter()
+    sc.set_log_level(_get_setting('log_level'))
+    prefs = sublime.load_settings('Preferences.sublime-settings')
+    _last_schemes = [prefs.get(name) for name in _scheme_prefs]
+    prefs.add_on_change(sc.get_plugin_name(), _on_prefs_change)
+    _startup_stats.append(_OpStat(time.time(), 'import', None, 0, _import_msecs, None))
+    _startup_stats.append(_OpStat(time.time(), 'plugin_loaded', None, 0, _elapsed_ms(start), None))
+
+
+#-----------------------------------------------------------------------------------
+def plugin_unloaded():
+    '''Called per plugin instance.'''
+    sublime.load_settings('Preferences.sublime-settings').clear_on_change(sc.get_plugin_name())
+    sc.flush_log()
+
+
+#-----------------------------------------------------------------------------------
+def _profiled(counted=True):
+    ''' Decorator. Runs the call under cProfile while a capture is on. Counted calls use up the capture,
+    the others are the background work they start. '''
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            capture = _profile
+            if capture is None or getattr(_profile_local, 'active', False):
+                return func(*args, **kwargs)
+            return _profile_call(capture, func, counted, args, kwargs)
+        return wrapper
+    return decorate
+
+
+#-----------------------------------------------------------------------------------
+def _profile_call(capture, func, counted, args, kwargs):
+    ''' One profiled call. A profiler each as the UI and async threads can both be in one. '''
+    import cProfile
+    prof = cProfile.Profile()
+    start = time.perf_counter()
+    _profile_local.active = True
+    try:
+        return prof.runcall(func, *args, **kwargs)
+    finally:
+        _profile_local.active = False
+        msecs = _elapsed_ms(start)
+        with _profile_lock:
+            capture.profiles.append(prof)
+            capture.ops.append((func.__qualname__, _op_file(args), msecs))
+            if counted:
+                capture.left -= 1
+            done = counted and capture.left == 0
+        if done:
+            # After the work already queued on the async thread.
+            sublime.set_timeout_async(lambda: _end_profile(capture), 0)
 
 
 #-----------------------------------------------------------------------------------
 class HighlightEvent(sublime_plugin.EventListener):
     ''' React to system events.'''
 
-    # Track what's been initialized.
-    _views_inited = set()
-
+    @_profiled()
     def on_init(self, views):
         ''' First thing that happens when plugin/window created. Load the persistence file. Views are valid. '''
+        start = time.perf_counter()
         if len(views) > 0:
             view = views[0]
             win = view.window()
@@ -74,18 +279,55 @@ class HighlightEvent(sublime_plugin.EventListener):
                 self._read_store()
                 for view in views:
                     self._init_view(view)
+        _startup_stats.append(_OpStat(time.time(), 'on_init', None, len(views), _elapsed_ms(start), None))
+
+        total = sum(stat.msecs for stat in _startup_stats)
+        over = f' - over budget of {_startup_budget_ms} ms' if total > _startup_budget_ms else ''
+        sc.debug('Startup ' + ' '.join(f'{stat.op}:{stat.msecs:.1f}' for stat in _startup_stats) + f' ms{over}')
 
+    @_profiled()
     def on_exit(self):
         ''' Save to file when closing. '''
         self._write_store()
+        sc.flush_log()
 
+    @_profiled()
     def on_load(self, view):
         ''' Load a file. '''
         self._init_view(view)
 
+    @_profiled()
+    def on_clone(self, view):
+        ''' New view of an already highlighted buffer. '''
+        self._init_view(view)
+
+    @_profiled()
+    def on_pre_close(self, view):
+        ''' Stop any background work and let go of the buffer state when the last view of a buffer goes. '''
+        bid = view.buffer_id()
+        state = _states.get(bid)
+        if state is not None:
+            state.shown.pop(view.id(), None)
+        if len(view.buffer().views()) <= 1:
+            _cancel_scans(view)
+            _states.pop(bid, None)
+
+    @_profiled()
     def on_post_save(self, view):
-        ''' Save a file, refresh. '''
-        self._highlight_view(view)
+        ''' Save a file, refresh. Not needed if edits are tracked. '''
+        fn = view.file_name()
+        if fn is not None and fn.endswith('.sublime-color-scheme'):
+            # Same scheme setting, new colors.
+            _color_scheme_changed()
+
+        if not _get_setting('incremental_highlight'):
+            self._highlight_view(view)
+        else:
+            # Edits only refresh the visible part of the dense slots. Get the true counts again.
+            state = _states.get(view.buffer_id())
+            slots = _get_slots(view)
+            if state is not None and len(state.dense) > 0 and slots is not None:
+                _schedule_highlight(view, {iind: tparams for iind, tparams in slots.items() if iind in state.dense})
 
     def _init_view(self, view):
         ''' Lazy init. '''
@@ -93,56 +335,190 @@ class HighlightEvent(sublime_plugin.EventListener):
         if view.is_scratch() is True or fn is None:
             return
 
-        # Init the view if not already.
-        vid = view.id()
-        if vid not in self._views_inited:
-            self._views_inited.add(vid)
+        start = time.perf_counter()
+        if _validated is not None:
+            # It's open so it exists.
+            _validated.add(fn)
+
+        # Init the buffer if not already. Views of a buffer that is already done get a copy of the regions.
+        # If its scan is still running they will get the results with the rest.
+        state = _get_state(view.buffer_id())
+        if not state.inited:
+            state.inited = True
             self._highlight_view(view)
+        else:
+            _copy_regions(view)
+            _show_visible(view)
+        _record_stat('init', fn, _elapsed_ms(start), view.size())
 
     def _read_store(self):
-        ''' General project opener. '''
-        global _hls
-
-        store_fn = sc.get_store_fn()
-        if os.path.isfile(store_fn):
-            try:
-                with open(store_fn, 'r') as fp:
-                    _temp_hls = json.load(fp)
-                    # Sanity checks. Easier to make a new clean collection rather than remove parts.
-                    _hls.clear()
-
-                    for fn, hls in _temp_hls.items():
-                        if os.path.exists(fn) and len(hls) > 0:
-                            _hls[fn] = hls
-            except Exception as e:
-                sc.error(f'Error reading {store_fn}: {e}', e.__traceback__)
-        else:  # Assume new file with default fields.
-            sublime.status_message('Creating new highlights file')
-            _hls = {}
+        ''' General project opener. Reads the shards of the open projects, the others when one of their files is
+        opened. Files that no longer exist are pruned later in the background. '''
+        store = _get_store()
+        start = time.perf_counter()
+        try:
+            _temp_hls, _temp_access = store.load(_open_folders())
+            # Sanity checks. Easier to make a new clean collection rather than remove parts.
+            _hls.clear()
+            _access.clear()
+            _dirty.clear()
+
+            for fn, hls in _temp_hls.items():
+                if len(hls) > 0:
+                    _hls[fn] = hls
+                    _access[fn] = _temp_access[fn]
+
+            _record_stat('read_store', store.index_fn, _elapsed_ms(start), len(_hls))
+            _check_store(list(_hls))
+            _evict_store()
+        except Exception as e:
+            sc.error(f'Error reading {store.index_fn}: {e}', e.__traceback__)
 
     def _write_store(self):
-        ''' General project saver. '''
-        global _hls
-        store_fn = sc.get_store_fn()
+        ''' General project saver. Saves what the autosave hasn't yet and folds the journal into the snapshot. '''
+        store = _get_store()
+        start = time.perf_counter()
         try:
-            with open(store_fn, 'w') as fp:
-                json.dump(_hls, fp, indent=4)
+            _take_dirty()
+            # Waits for a save running on the async thread.
+            with _sync_lock:
+                with _unsynced_lock:
+                    records = list(_unsynced)
+                # The windows may be gone on exit, then it's the folders from the last save.
+                store.sync(records, dict(_access), compact=True, folders=_open_folders() or None)
+                with _unsynced_lock:
+                    del _unsynced[:len(records)]
+            _record_stat('write_store', store.index_fn, _elapsed_ms(start), len(_hls))
         except Exception as e:
-            sc.error(f'Error writing {store_fn}: {e}', e.__traceback__)
+            sc.error(f'Error writing {store.index_fn}: {e}', e.__traceback__)
 
     def _highlight_view(self, view):
-        ''' Colorize the view. '''
-        hl_vals = _get_hl_vals(view, init=False)
-        if hl_vals is not None:
-            for hl_index, tparams in hl_vals.items():
-                _highlight_view(view, tparams['token'], tparams['whole_word'], hl_index)
+        ''' Colorize the view in the background. '''
+        if _get_hl_vals(view, init=False) is not None:
+            _schedule_highlight(view)
+
+
+#-----------------------------------------------------------------------------------
+class HighlightTextChangeListener(sublime_plugin.TextChangeListener):
+    ''' Rehighlight just the edited lines after typing settles. One per buffer. '''
+
+    def __init__(self):
+        super().__init__()
+        # Edited spans as [start, end] in current buffer coordinates, sorted, not overlapping.
+        self._spans = []
+        # Debounce - only the latest scheduled flush runs.
+        self._gen = 0
+
+    @classmethod
+    def is_applicable(cls, buffer):
+        # Highlights can be added after the buffer is opened so check later.
+        return True
+
+    def on_text_changed_async(self, changes):
+        ''' Collect the changed spans then schedule the rescan. '''
+        if not _get_setting('incremental_highlight') or self.buffer.file_name() not in _hls:
+            return
+
+        for change in changes:
+            self._add_change(change.a.pt, change.b.pt, len(change.str))
+
+        self._gen += 1
+        gen = self._gen
+        sublime.set_timeout_async(lambda: self._flush(gen), _incremental_delay)
+
+    def _add_change(self, a, b, inserted):
+        ''' Map existing spans through one change: a-b replaced by inserted chars. '''
+        delta = inserted - (b - a)
+
+        def map_pt(pt, is_end):
+            if pt <= a:
+                return pt
+            if pt >= b:
+                return pt + delta
+            # Inside the replaced text.
+            return a + inserted if is_end else a
+
+        spans = [[map_pt(s, False), map_pt(e, True)] for s, e in self._spans]
+        spans.append([a, a + inserted])
+        spans.sort()
+
+        # Merge touching.
+        self._spans = [spans[0]]
+        for s, e in spans[1:]:
+            last = self._spans[-1]
+            if s <= last[1]:
+                last[1] = max(last[1], e)
+            else:
+                self._spans.append([s, e])
+
+    @_profiled()
+    def _flush(self, gen):
+        ''' Debounced rescan of the collected spans. '''
+        if gen != self._gen or len(self._spans) == 0:
+            return
+
+        views = self.buffer.views()
+        slots = _get_slots(views[0]) if len(views) > 0 else None
+        if slots is None:
+            self._spans = []
+            return
+        # Only the visible part of dense slots is shown. The poll picks up the change.
+        state = _get_state(self.buffer.id())
+        sparse = {iind: tparams for iind, tparams in slots.items() if iind not in state.dense}
+
+        spans = self._spans
+        self._spans = []
+        view = views[0]
+        size = view.size()
+        start = time.perf_counter()
+
+        # Fall back to a full rescan when the edits are all over the place.
+        dirty = sum(e - s for s, e in spans)
+        if len(spans) > _incremental_max_spans or dirty > size // 4:
+            _highlight_view(view, slots)
+            return
+
+        matcher = _Matcher(sparse)
+        if len(matcher.slots) == 0:
+            return
+
+        change_count = view.change_count()
+
+        # Expand to whole lines. Spans on the same line end up as one.
+        cores = []
+        for s, e in spans:
+            core = view.full_line(sublime.Region(min(s, size), min(e, size)))
+            if len(cores) > 0 and core.a <= cores[-1][1]:
+                cores[-1] = (cores[-1][0], max(cores[-1][1], core.b))
+            else:
+                cores.append((core.a, core.b))
+
+        hits = {iind: [] for iind, _ in matcher.slots}
+        for ca, cb in cores:
+            # Widened so tokens crossing the line ends are found again.
+            lo = max(0, ca - matcher.max_len)
+            hi = min(size, cb + matcher.max_len)
+            for iind, found in matcher.scan_region(view, lo, hi).items():
+                hits[iind].extend((a, b) for a, b in found if a <= cb and b >= ca)
+
+        # More typing happened while scanning. Put the spans back, the next flush gets them.
+        if view.change_count() != change_count:
+            for s, e in spans:
+                self._add_change(s, e, e - s)
+            return
+
+        _merge_hits(views, hits, cores)
+        if len(matcher.failed) > 0:
+            _disable_slots(view, matcher.failed)
+        _record_stat('edit', view.file_name(), _elapsed_ms(start), sum(cb - ca for ca, cb in cores), _hit_counts(hits))
 
 
 #-----------------------------------------------------------------------------------
 class SbotHighlightTextCommand(sublime_plugin.TextCommand):
     ''' Highlight specific words using scopes. Parts borrowed from StyleToken. '''
 
-    def run(self, edit, hl_index):
+    @_profiled()
+    def run(self, edit, hl_index, regex=False, ignore_case=False):
         del edit
         # Get whole word or specific span.
         region = self.view.sel()[0]
@@ -152,10 +528,68 @@ class SbotHighlightTextCommand(sublime_plugin.TextCommand):
             region = self.view.word(region)
         token = self.view.substr(region)
 
-        hl_vals = _get_hl_vals(self.view, init=True)
-        if hl_vals is not None:
-            hl_vals[hl_index] = {"token": token, "whole_word": whole_word}
-        _highlight_view(self.view, token, whole_word, hl_index)
+        if regex:
+            # Start with the selection, let the user make it into a pattern.
+            self.view.window().show_input_panel('Highlight regex:', token,
+                                                lambda text: self._set_token(int(hl_index), text, False, True, ignore_case), None, None)
+        else:
+            self._set_token(int(hl_index), token, whole_word, False, ignore_case)
+
+    @_profiled()
+    def _set_token(self, iind, token, whole_word, regex, ignore_case):
+        ''' Update the slot and rescan. '''
+        tparams = {"token": token, "whole_word": whole_word}
+        # Only stored when set, older entries don't have them.
+        if regex:
+            tparams['regex'] = True
+        if ignore_case:
+            tparams['ignore_case'] = True
+
+        if regex:
+            try:
+                pattern = _get_pattern(tparams)
+            except re.error as e:
+                sc.info(f'Bad regex {token}: {e}')
+                return
+            # Empty matches are skipped by the scans, these have no others. Like \b or (?=x).
+            if sre_parse.parse(pattern.pattern, pattern.flags).getwidth()[1] == 0:
+                sc.info(f'Regex {token} only matches empty text, it would highlight nothing')
+                return
+
+        _set_slot(self.view, iind, tparams)
+
+
+#-----------------------------------------------------------------------------------
+class SbotHighlightWordsCommand(sublime_plugin.TextCommand):
+    ''' Highlight every word in a word list file with one scope. '''
+
+    def run(self, edit, hl_index, words_file=None, whole_word=True, ignore_case=False):
+        del edit
+        if words_file is None:
+            self.view.window().show_input_panel('Word list file:', '',
+                                                lambda fn: self._set_words(int(hl_index), fn, whole_word, ignore_case), None, None)
+        else:
+            self._set_words(int(hl_index), words_file, whole_word, ignore_case)
+
+    def _set_words(self, iind, words_file, whole_word, ignore_case):
+        ''' Update the slot and rescan. '''
+        words_file = sc.expand_vars(os.path.expanduser(words_file.strip()))
+        if words_file is None or not os.path.isfile(words_file):
+            sc.info(f'Can\'t find word list {words_file}')
+            return
+
+        tparams = {"token": os.path.basename(words_file), "whole_word": whole_word, "words_file": words_file}
+        if ignore_case:
+            tparams['ignore_case'] = True
+
+        try:
+            # Build it now so problems show up here rather than in the scan.
+            _get_words(tparams)
+        except (OSError, re.error) as e:
+            sc.info(f'Bad word list {words_file}: {e}')
+            return
+
+        _set_slot(self.view, iind, tparams)
 
 
 #-----------------------------------------------------------------------------------
@@ -181,10 +615,15 @@ class SbotClearHighlightsCommand(sublime_plugin.TextCommand):
             if file == fn:
                 # Remove from persist collection.
                 del _hls[fn]
-                # Clear visuals in view.
+                _persist(fn)
+                _cancel_scans(view)
+                _get_state(view.buffer_id()).clear()
+                # Clear visuals in view and its clones.
                 hl_info = sc.get_highlight_info('user')
-                for hl in hl_info:
-                    view.erase_regions(hl.region_name)
+                for v in view.buffer().views():
+                    for hl in hl_info:
+                        v.erase_regions(hl.region_name)
+                    v.erase_status(_hits_status)
                 break
 
 
@@ -198,34 +637,128 @@ class SbotClearAllHighlightsCommand(sublime_plugin.TextCommand):
 
         # Bam.
         _hls.clear()
+        _access.clear()
+        _dirty.clear()
+        # After a save that is running, it drops what it wrote from _unsynced.
+        with _sync_lock, _unsynced_lock:
+            del _unsynced[:]
+        _get_match_cache().clear()
+        store = _get_store()
+        try:
+            store.clear()
+        except Exception as e:
+            sc.error(f'Error writing {store.index_fn}: {e}', e.__traceback__)
 
         # Clear visuals in open views.
+        for state in _states.values():
+            state.clear()
         hl_info = sc.get_highlight_info('user')
         for view in win.views():  # pyright: ignore
+            _cancel_scans(view)
             for hl in hl_info:
                 view.erase_regions(hl.region_name)
+            view.erase_status(_hits_status)
 
 
 #-----------------------------------------------------------------------------------
-class SbotAllScopesCommand(sublime_plugin.TextCommand):
-    ''' Show style info for common scopes. '''
+class SbotFindHighlightsCommand(sublime_plugin.TextCommand):
+    ''' Find where the highlighted tokens occur in all files in the window folders. '''
+
+    def run(self, edit, all_files=False):
+        del edit
+        global _search_gen
+
+        win = self.view.window()
+        folders = win.folders()  # pyright: ignore
+
+        # This file's tokens or every stored one.
+        if all_files:
+            sources = list(_hls.values())
+        else:
+            hl_vals = _get_hl_vals(self.view, init=False)
+            sources = [hl_vals] if hl_vals is not None else []
+
+        tokens = []
+        for hl_vals in sources:
+            for tparams in hl_vals.values():
+                if len(tparams['token']) > 0 and not tparams.get('disabled') and tparams not in tokens:
+                    tokens.append(tparams)
+
+        if len(tokens) == 0 or len(folders) == 0:
+            sc.info('No highlights or folders to search')
+            return
+
+        # Same idea of what to skip as the builtin find in files.
+        settings = self.view.settings()
+        exclude_dirs = settings.get('folder_exclude_patterns', [])
+        exclude_files = settings.get('file_exclude_patterns', []) + settings.get('binary_file_patterns', [])
+        max_bytes = _get_setting('search_max_file_mb') * 1024 * 1024
+
+        header = f'Searching {", ".join(folders)} for {", ".join(tparams["token"] for tparams in tokens)}\n\n'
+        rview = sc.create_new_view(win, header)
+        rview.settings().set('result_file_regex', _result_regex)
+
+        _search_gen += 1
+        gen = _search_gen
+        patterns = []
+        for tparams in tokens:
+            try:
+                patterns.append((tparams['token'], _search_pattern(tparams), tparams.get('regex')))
+            except (OSError, re.error) as e:
+                sc.info(f'Skipping {tparams["token"]}: {e}')
+        threading.Thread(target=lambda: _search_folders(gen, rview, folders, patterns, exclude_dirs, exclude_files, max_bytes),
+                         daemon=True).start()
+
+
+#-----------------------------------------------------------------------------------
+class SbotOpenSearchResultCommand(sublime_plugin.TextCommand):
+    ''' Open the file:line at the caret in the search results. '''
 
     def run(self, edit):
         del edit
-        scopes = []
+        caret = sc.get_single_caret(self.view)
+        if caret is not None:
+            m = re.match(_result_regex, self.view.substr(self.view.line(caret)))
+            if m is not None:
+                sc.wait_load_file(self.view.window(), m.group(1), int(m.group(2)))
 
-        if (self.view.file_name() is not None and self.view.syntax() is not None and self.view.syntax().name == 'Notr'):
-            scopes.extend(_notr_scopes)
-        scopes.extend(_markup_scopes)
-        scopes.extend(_internal_scopes)
-        scopes.extend(_syntax_scopes)
-        scopes.extend(_generic_colors_scopes)
-        # User requests?
-        settings = sublime.load_settings(sc.get_settings_fn())
-        extra_scopes = settings.get('scopes_to_show')
-        scopes.extend(extra_scopes)  # pyright: ignore
 
-        _render_scopes(scopes, self.view)
+#-----------------------------------------------------------------------------------
+class SbotExportHtmlCommand(sublime_plugin.TextCommand):
+    ''' Write the file with its highlights as html, for people without ST. Or every file read from the store. '''
+
+    def is_visible(self, all_files=False):
+        return all_files or (self.view.file_name() is not None and self.view.file_name() in _hls)
+
+    def run(self, edit, all_files=False):
+        del edit
+        out_dir = os.path.join(sc.get_store_path(), 'export')
+        styles = _export_styles(self.view)
+
+        if all_files:
+            # Copies, the commands can change them while the workers run.
+            files = [(fn, {k: dict(v) for k, v in hl_vals.items()}) for fn, hl_vals in _hls.items() if len(hl_vals) > 0]
+            threading.Thread(target=lambda: _export_files(files, out_dir, styles), daemon=True).start()
+        else:
+            fn = self.view.file_name()
+            hl_vals = _get_hl_vals(self.view, init=False)
+            if fn is None or not hl_vals:
+                return
+            if self.view.is_dirty():
+                sc.info('Exporting the saved file, not the unsaved changes')
+            out_fn = os.path.join(out_dir, os.path.basename(fn) + '.html')
+            hl_vals = {k: dict(v) for k, v in hl_vals.items()}
+            # Not on the async thread, a big one would hold up the highlighting.
+            threading.Thread(target=lambda: _export_files([(fn, hl_vals)], out_dir, styles, out_fn), daemon=True).start()
+
+
+#-----------------------------------------------------------------------------------
+class SbotAllScopesCommand(sublime_plugin.TextCommand):
+    ''' Show style info for common scopes. '''
+
+    def run(self, edit):
+        del edit
+        _render_scopes(_get_all_scopes(self.view), self.view)
 
 #-----------------------------------------------------------------------------------
 class SbotScopeInfoCommand(sublime_plugin.TextCommand):
@@ -240,6 +773,52 @@ class SbotScopeInfoCommand(sublime_plugin.TextCommand):
             _render_scopes(scopes, self.view)
 
 
+#-----------------------------------------------------------------------------------
+class SbotGotoHighlightCommand(sublime_plugin.TextCommand):
+    ''' Select the next or previous match of a slot, or of any slot. Wraps around at the ends. '''
+
+    def run(self, edit, forward=True, hl_index=None):
+        del edit
+        view = self.view
+        slots = _get_slots(view)
+        if not slots:
+            return
+        if hl_index is not None:
+            iind = int(hl_index)
+            slots = {iind: slots[iind]} if iind in slots else {}
+
+        sel = view.sel()
+        pt = sel[0].begin() if len(sel) > 0 else 0
+        span = self._find(slots, pt, forward)
+        if span is None:
+            span = self._find(slots, -1 if forward else view.size() + 1, forward)
+            if span is None:
+                sc.info('No matches')
+                return
+            sc.info('Wrapped around')
+
+        region = sublime.Region(span[0], span[1])
+        sel.clear()
+        sel.add(region)
+        view.show(region)
+
+    def _find(self, slots, pt, forward):
+        ''' Nearest match after or before pt of all slots. '''
+        index = _get_index(self.view)
+        dense = _get_state(self.view.buffer_id()).dense
+        spans = []
+        for iind, tparams in slots.items():
+            if iind in dense:
+                span = _scan_next(self.view, iind, tparams, pt, forward)
+            else:
+                span = index.next(iind, pt, forward)
+            if span is not None:
+                spans.append(span)
+        if len(spans) == 0:
+            return None
+        return min(spans) if forward else max(spans)
+
+
 #-----------------------------------------------------------------------------------
 class SbotCurrentHighlightsCommand(sublime_plugin.TextCommand):
     ''' Show style info for current highlights. '''
@@ -251,12 +830,16 @@ class SbotCurrentHighlightsCommand(sublime_plugin.TextCommand):
         style_text = []
 
         # Current highlights.
-        hl_vals = _get_hl_vals(self.view, init=False)
-        if hl_vals is not None:
-            for hl_index, tparams in hl_vals.items():
-                iind = int(hl_index)
+        slots = _get_slots(self.view)
+        if slots is not None:
+            dense = _get_state(self.view.buffer_id()).dense
+            for iind, tparams in slots.items():
+                if iind in dense:
+                    count = f'{dense[iind]} matches, visible part only'
+                else:
+                    count = f'{_get_index(self.view).count(iind)} matches'
                 scope = _internal_scopes[iind]
-                style = self.view.style_for_scope(scope)
+                style = _get_style(self.view, scope)
                 props = f'{{ color:{style["foreground"]}; '
                 if 'background' in style:
                     props += f'background-color:{style["background"]}; '
@@ -265,7 +848,10 @@ class SbotCurrentHighlightsCommand(sublime_plugin.TextCommand):
                 i = len(style_text)
                 style_text.append(f'.st{i} {props}')
                 token = tparams['token']
-                content.append(f'<p><span class=st{i}>HL {iind + 1}: [{token}]</span></p>')
+                modes = [name.replace('_', ' ') for name in ['words_file', 'regex', 'ignore_case', 'disabled'] if tparams.get(name)]
+                if tparams.get('disabled'):
+                    count = 'too slow'
+                content.append(f'<p><span class=st{i}>HL {iind + 1}: [{token}]</span> {" ".join(modes)} {count}</p>')
         else:
             content.append(f'<b>No Highlights</b>')
 
@@ -285,23 +871,1509 @@ class SbotCurrentHighlightsCommand(sublime_plugin.TextCommand):
 
 
 #-----------------------------------------------------------------------------------
-def _highlight_view(view, token, whole_word, hl_index):
-    ''' Colorize one token. '''
+class SbotHighlightStatsCommand(sublime_plugin.TextCommand):
+    ''' Show recent operation timings for this file and the slowest overall. '''
+
+    def run(self, edit):
+        del edit
+        content = []
+        stats = list(_stats)
+        fn = self.view.file_name()
+        slow_ms = _get_setting('slow_op_ms')
+
+        def describe(stat, show_fn=False):
+            size = f'{stat.size} files' if stat.op.endswith('_store') else f'{stat.size} chars'
+            text = f'{stat.op}: {stat.msecs:.1f} ms {size}'
+            if stat.counts:
+                text += ' ' + ' '.join(f'HL{n}:{count}' for n, count in sorted(stat.counts.items()))
+            if show_fn:
+                text += f' {os.path.basename(stat.fn or "")}'
+            cls = 'slow' if slow_ms and stat.msecs >= slow_ms else 'norm'
+            return f'<p class={cls}>{text}</p>'
+
+        # This file, newest first.
+        content.append(f'<p><b>{os.path.basename(fn) if fn is not None else "This view"}</b></p>')
+        mine = [stat for stat in stats if stat.fn == fn]
+        if len(mine) > 0:
+            content.extend(describe(stat) for stat in reversed(mine[-20:]))
+        else:
+            content.append('<p>No operations recorded</p>')
+
+        # Totals per operation.
+        content.append('<p><b>All files</b></p>')
+        by_op = {}
+        for stat in stats:
+            by_op.setdefault(stat.op, []).append(stat.msecs)
+        for op, msecs in sorted(by_op.items()):
+            content.append(f'<p class=norm>{op}: {len(msecs)} ops avg {sum(msecs) / len(msecs):.1f} ms max {max(msecs):.1f} ms</p>')
+
+        # Our share of ST startup.
+        if len(_startup_stats) > 0:
+            total = sum(stat.msecs for stat in _startup_stats)
+            cls = 'slow' if total > _startup_budget_ms else 'norm'
+            content.append('<p><b>Startup</b></p>')
+            text = ' '.join(f'{stat.op}:{stat.msecs:.1f}' for stat in _startup_stats)
+            content.append(f'<p class={cls}>{text} ms, budget {_startup_budget_ms} ms</p>')
+
+        # Worst offenders.
+        slowest = sorted((stat for stat in stats if stat.op != 'init'), key=lambda stat: stat.msecs, reverse=True)[:5]
+        if len(slowest) > 0:
+            content.append('<p><b>Slowest</b></p>')
+            for stat in slowest:
+                content.append(describe(stat, show_fn=True))
+
+        # Slow ones get the red highlight color.
+        norm = _get_style(self.view, 'text')
+        slow = _get_style(self.view, 'region.redish')
+        st = f'.norm {{ color:{norm["foreground"]}; }}\n.slow {{ color:{slow["foreground"]}; }}'
+        ct = '\n'.join(content)
+
+        # Html for popup.
+        html = f'''
+    <body>
+    <style> p {{ margin: 0em; }} {st} </style>
+    {ct}
+    </body>
+    '''
+
+        self.view.show_popup(html, max_width=700, max_height=600)
+
+
+#-----------------------------------------------------------------------------------
+class SbotHighlightStoreInfoCommand(sublime_plugin.TextCommand):
+    ''' Show how big the store is and how close it is to the limits. '''
+
+    def run(self, edit):
+        del edit
+        content = []
+        store = _get_store()
+        max_files = _get_setting('store_max_files')
+        max_days = _get_setting('store_max_days')
+
+        try:
+            shards, loaded, snapshot_bytes, journal_bytes = store.sizes()
+            unread = store.unread_files()
+            cache_count, cache_bytes = _get_match_cache().sizes()
+        except Exception as e:
+            sc.error(f'Error reading {store.index_fn}: {e}', e.__traceback__)
+            return
+
+        limit = f' of {max_files}' if max_files else ''
+        content.append(f'<p>Files: {len(_hls) + unread}{limit}, {len(_hls)} loaded</p>')
+        content.append(f'<p>Shards: {shards}, {loaded} loaded</p>')
+        if len(_access) > 0:
+            days = (time.time() - min(_access.values())) / 86400
+            limit = f', evicted after {max_days} days' if max_days else ''
+            content.append(f'<p>Oldest used: {days:.0f} days ago{limit}</p>')
+        content.append(f'<p>Snapshots: {snapshot_bytes / 1024:.1f} KB</p>')
+        content.append(f'<p>Journals: {journal_bytes / 1024:.1f} KB</p>')
+        content.append(f'<p>Match cache: {cache_bytes / (1024 * 1024):.1f} MB in {cache_count} files of {_get_setting("match_cache_mb")} MB</p>')
+        ct = '\n'.join(content)
+
+        # Html for popup.
+        html = f'''
+    <body>
+    <style> p {{ margin: 0em; }} </style>
+    {ct}
+    </body>
+    '''
+
+        self.view.show_popup(html, max_width=700, max_height=600)
+
+
+#-----------------------------------------------------------------------------------
+class SbotHighlightProfileCommand(sublime_plugin.TextCommand):
+    ''' Profile the next count event callbacks and highlight commands, plus the scans and saves they start.
+    Run again to stop early. Writes a .pstats and a summary .txt to the store dir. '''
+
+    def run(self, edit, count=20):
+        global _profile
+        del edit
+        capture = _profile
+        if capture is not None:
+            _end_profile(capture)
+        else:
+            _profile = _ProfileCapture(int(count))
+            sc.info(f'Profiling the next {count} operations')
+
+
+#-----------------------------------------------------------------------------------
+class _ProfileCapture:
+    ''' What has been profiled so far. '''
+
+    def __init__(self, count):
+        # Counted operations still to do.
+        self.left = count
+        # One cProfile.Profile per call.
+        self.profiles = []
+        # (function, file, msecs) per call in the order they finished.
+        self.ops = []
+
+
+#-----------------------------------------------------------------------------------
+class _BufferState:
+    ''' What is kept for an open buffer. Made on first use, dropped when its last view closes. '''
+    __slots__ = ('gen', 'inited', 'slots', 'dense', 'dense_matcher', 'shown', 'index')
+
+    def __init__(self):
+        # Scan generation. Bumping it cancels the running scan and drops results not applied yet.
+        self.gen = 0
+        # The buffer was highlighted when its first view opened.
+        self.inited = False
+        # The file's slots from _hls keyed by int hl_index. None until asked for or after they change.
+        self.slots = None
+        # Slots with more matches than max_matches_per_slot only get regions in the visible part.
+        # hl_index: true match count.
+        self.dense = {}
+        # Matcher of the dense slots for the visible part. None until needed or after they change.
+        self.dense_matcher = None
+        # What was shown for the dense slots of each view: view id: (visible start, visible end, change count).
+        self.shown = {}
+        # Sorted match offsets, see _get_index().
+        self.index = None
+
+    def clear(self):
+        ''' The slots changed or were removed. Everything but the scan generation is out of date. '''
+        self.slots = None
+        self.dense = {}
+        self.dense_matcher = None
+        self.shown = {}
+        self.index = None
+
+
+#-----------------------------------------------------------------------------------
+class _HitIndex:
+    ''' Sorted offsets of the matches of each slot of a buffer. '''
+
+    def __init__(self, change_count):
+        # Buffer change count the offsets are good for.
+        self.change_count = change_count
+        # hl_index: starts, and the ends that go with them. A slot's regions don't overlap so both are sorted.
+        self.starts = {}
+        self.ends = {}
+
+    def set(self, iind, spans):
+        ''' New matches of a slot, sorted list of (start, end). '''
+        self.starts[iind] = [a for a, _ in spans]
+        self.ends[iind] = [b for _, b in spans]
+
+    def count(self, iind):
+        return len(self.starts.get(iind, ()))
+
+    def next(self, iind, pt, forward):
+        ''' (start, end) of the first match starting after pt, or the last one starting before it. None if no more. '''
+        starts = self.starts.get(iind, [])
+        if forward:
+            i = bisect.bisect_right(starts, pt)
+            return (starts[i], self.ends[iind][i]) if i < len(starts) else None
+        i = bisect.bisect_left(starts, pt) - 1
+        return (starts[i], self.ends[iind][i]) if i >= 0 else None
+
+
+#-----------------------------------------------------------------------------------
+class _Matcher:
+    ''' All the active slots of a view compiled once. scan() reads the text once and returns the hits split per slot. '''
+
+    def __init__(self, slots, limit=0):
+        # List of (hl_index, compiled pattern).
+        self.slots = []
+        # Longest token, used to widen partial scans.
+        self.max_len = 0
+        # Most hits kept per slot in one scan(), 0 is no limit.
+        self.limit = limit
+        # Slots over the limit in the last scan(): hl_index: match count.
+        self.over = {}
+        # Regex slots, they get a time budget.
+        self.timed = set()
+        # Slots dropped for going over the budget.
+        self.failed = set()
+        hl_count = len(sc.get_highlight_info('user'))
+
+        for iind, tparams in slots.items():
+            token = tparams['token']
+            if iind >= hl_count:
+                sc.error(f'Invalid scope index {iind}')
+            elif len(token) > 0 and not tparams.get('disabled'):
+                try:
+                    if tparams.get('words_file'):
+                        pattern, max_len = _get_words(tparams)
+                    else:
+                        pattern = _get_pattern(tparams)
+                        max_len = _regex_max_len if tparams.get('regex') else len(token)
+                except (OSError, re.error) as e:
+                    sc.debug(f'Skipping {token}: {e}')
+                    continue
+                self.slots.append((iind, pattern))
+                self.max_len = max(self.max_len, max_len)
+                if tparams.get('regex'):
+                    self.timed.add(iind)
+
+    def scan(self, text, offset=0, pos=0, stop=None):
+        '''
+        Find all slots in text starting at pos, and before stop if given. Returns dict of hl_index: [(start, end), ...]
+        shifted by offset. Slots with more than limit hits get [] and are just counted, see over.
+        '''
+        hits = {}
+        self.over = {}
+        # Every pattern starts with a literal so sre runs its fast prefix search for each. That is far quicker
+        # than one combined alternation, which sre can only try char by char. See bench/bench_scan.py.
+        for iind, pattern in self.slots:
+            if iind in self.timed:
+                matches = _budgeted(pattern, text, pos, self.failed, iind)
+            else:
+                matches = pattern.finditer(text, pos)
+            if stop is not None:
+                matches = itertools.takewhile(lambda m: m.start() < stop, matches)
+            taken = matches if self.limit == 0 else itertools.islice(matches, self.limit + 1)
+            if offset == 0:
+                found = [m.span() for m in taken]
+            else:
+                found = [(m.start() + offset, m.end() + offset) for m in taken]
+            if self.limit > 0 and len(found) > self.limit:
+                # Runaway token. Count the rest without making spans.
+                self.over[iind] = len(found) + sum(1 for _ in matches)
+                found = []
+            hits[iind] = found
+
+        if len(self.failed) > 0:
+            self.slots = [(iind, pattern) for iind, pattern in self.slots if iind not in self.failed]
+            for iind in self.failed:
+                hits[iind] = []
+            self.over = {iind: count for iind, count in self.over.items() if iind not in self.failed}
+        return hits
+
+    def scan_region(self, view, a, b, stop=None):
+        ''' Scan part of a view. Reads a char either side so the whole word tests at the edges see the real neighbors. '''
+        lo = max(0, a - 1)
+        text = view.substr(sublime.Region(lo, min(view.size(), b + 1)))
+        return self.scan(text, lo, a - lo, None if stop is None else stop - lo)
+
+
+
+#-----------------------------------------------------------------------------------
+def _budgeted(pattern, text, pos, failed, key, clock=time.perf_counter):
+    '''
+    Non empty matches of a regex in text from pos until it has taken too long, then key is added to failed. The time
+    is checked at each match and between windows. Python can't stop one search step so a window is only made bigger
+    while it is quick. text can be str, bytes or mmap.
+    '''
+    deadline = clock() + _regex_budget
+    size = len(text)
+    window = _regex_window_min
+    # End of the last match, the next one can start here.
+    done = pos
+    while pos < size:
+        start = clock()
+        end = min(size, pos + window)
+        # The window only finds where matches may start. Its end looks like the end of the text to $, \b and
+        # lookaheads, and cuts long matches short.
+        starts = [m.start() for m in pattern.finditer(text, pos, min(size, end + _regex_max_len))]
+        # The last one that is a real match bounds the search of the whole text up to it, which finds the
+        # right matches. It can also find ones too long for the windows before.
+        last = None
+        for found in reversed(starts):
+            if found >= end:
+                continue
+            full = pattern.match(text, found)
+            if full is not None and full.end() > found:
+                last = found
+                break
+        if last is not None:
+            for m in pattern.finditer(text, done):
+                if clock() > deadline:
+                    failed.add(key)
+                    return
+                if m.end() > m.start():
+                    yield m
+                done = m.end()
+                if done > last:
+                    break
+
+        now = clock()
+        if now > deadline:
+            failed.add(key)
+            return
+        if now - start < _regex_budget / 64:
+            window = min(window * 2, _regex_window_max)
+        else:
+            window = max(window // 2, _regex_window_min)
+        pos = max(end, done)
+
+
+#-----------------------------------------------------------------------------------
+def _get_pattern(tparams):
+    ''' Compiled pattern for a slot. The same few are asked for on every scan and edit so keep the recent ones. '''
+    token = tparams['token']
+    flags = re.IGNORECASE if tparams.get('ignore_case') else 0
+    if tparams.get('whole_word'):
+        flags |= _WHOLE_WORD
+    if tparams.get('regex'):
+        flags |= _REGEX
+    key = (token, flags)
+
+    with _patterns_lock:
+        pattern = _patterns.get(key)
+        if pattern is not None:
+            _patterns.move_to_end(key)
+            return pattern
+
+    pattern = re.compile(_token_pattern(token, flags & _WHOLE_WORD, flags & _REGEX), flags & re.IGNORECASE)
+    with _patterns_lock:
+        _patterns[key] = pattern
+        if len(_patterns) > _patterns_size:
+            _patterns.popitem(last=False)
+    return pattern
+
+
+#-----------------------------------------------------------------------------------
+def _token_pattern(token, whole_word, regex=False):
+    ''' Regex for one token. '''
+    if regex:
+        return r'\b(?:%s)\b' % token if whole_word else token
     escaped = re.escape(token)
-    if whole_word:  # and escaped[0].isalnum():
-        escaped = r'\b%s\b' % escaped
+    if whole_word:
+        # Same as \b%s\b but with the leading boundary moved into a lookbehind so the pattern
+        # starts with the literal. A leading \b disables the sre prefix search.
+        lookbehind = r'(?<!\w%s)' if _word_char.match(token[0]) else r'(?<=\w%s)'
+        escaped = escaped + r'\b' + lookbehind % escaped
+    return escaped
+
+
+#-----------------------------------------------------------------------------------
+def _get_words(tparams):
+    '''
+    Compiled pattern and longest word for a dictionary slot. Built once per word list, and again
+    when the file changes.
+    '''
+    words_file = tparams['words_file']
+    stat = os.stat(words_file)
+    flags = re.IGNORECASE if tparams.get('ignore_case') else 0
+    if tparams.get('whole_word'):
+        flags |= _WHOLE_WORD
+    key = (words_file, stat.st_size, stat.st_mtime_ns, flags)
+
+    with _patterns_lock:
+        entry = _word_lists.get(key)
+        if entry is not None:
+            _word_lists.move_to_end(key)
+            return entry
+
+    words = _read_words(words_file)
+    if flags & re.IGNORECASE:
+        words = {word.lower() for word in words}
+    if len(words) == 0:
+        raise re.error('no words')
+    entry = (re.compile(_words_pattern(words, flags & _WHOLE_WORD), flags & re.IGNORECASE), max(len(word) for word in words))
+
+    with _patterns_lock:
+        _word_lists[key] = entry
+        if len(_word_lists) > _word_lists_size:
+            _word_lists.popitem(last=False)
+    return entry
+
+
+#-----------------------------------------------------------------------------------
+def _read_words(words_file):
+    ''' One word per line. Blank lines and lines starting with # are skipped. '''
+    with open(words_file, 'r', encoding='utf-8', errors='replace') as fp:
+        words = (line.strip() for line in fp)
+        return {word for word in words if len(word) > 0 and not word.startswith('#')}
+
+
+#-----------------------------------------------------------------------------------
+def _words_pattern(words, whole_word):
+    '''
+    Regex for a set of words. The words go in a trie which is written out as nested groups, so sre walks the
+    trie at each position in one pass instead of trying every word - a plain alternation of thousands of words
+    is about 100x slower. Longer words win. Whole word means not next to a word char.
+    '''
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        # End of a word.
+        node[''] = None
+
+    def to_regex(node):
+        # None if node is a leaf.
+        if len(node) == 1 and '' in node:
+            return None
+        branches = []
+        leaves = []
+        for ch in sorted(k for k in node if k != ''):
+            rest = to_regex(node[ch])
+            if rest is None:
+                leaves.append(re.escape(ch))
+            else:
+                branches.append(re.escape(ch) + rest)
+        only_leaves = len(branches) == 0
+        if len(leaves) > 0:
+            branches.append(leaves[0] if len(leaves) == 1 else '[' + ''.join(leaves) + ']')
+        regex = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            # A word ends here too. Optional part is greedy so the longer word is tried first.
+            regex = regex + '?' if only_leaves else '(?:' + regex + ')?'
+        return regex
+
+    regex = to_regex(trie)
+    return r'(?<!\w)(?:%s)(?!\w)' % regex if whole_word else regex
+
+
+#-----------------------------------------------------------------------------------
+def _search_pattern(tparams):
+    ''' Bytes regex of a slot for the project search. '''
+    if tparams.get('words_file'):
+        regex = _words_pattern(_read_words(tparams['words_file']), tparams.get('whole_word'))
+    else:
+        regex = _token_pattern(tparams['token'], tparams.get('whole_word'), tparams.get('regex'))
+    return re.compile(regex.encode('utf-8'), re.IGNORECASE if tparams.get('ignore_case') else 0)
+
+
+#-----------------------------------------------------------------------------------
+def _set_slot(view, iind, tparams):
+    ''' Store the new slot contents and rescan. '''
+    hl_vals = _get_hl_vals(view, init=True)
+    if hl_vals is None:
+        return
+    # json has string keys.
+    hl_vals[str(iind)] = tparams
+    _persist(view.file_name())
+    # Only this slot changed so only scan for it. Big views restart the background scan with the new token set.
+    _schedule_highlight(view, _get_slots(view) if _use_chunks(view) else {iind: tparams})
+
+
+#-----------------------------------------------------------------------------------
+def _schedule_highlight(view, slots=None):
+    '''
+    Queue a scan of the view's buffer on the async thread. slots is hl_index: tparams to do, None means all of them.
+    Requests for a buffer that is already queued are coalesced into the queued one.
+    '''
+    bid = view.buffer_id()
+    with _sched_lock:
+        if bid in _pending:
+            queued = _pending[bid]
+            if queued is not None and slots is not None:
+                queued.update(slots)
+            else:
+                _pending[bid] = None
+            return
+        _pending[bid] = None if slots is None else dict(slots)
+
+    buffer = view.buffer()
+    sublime.set_timeout_async(lambda: _run_highlight(buffer), 0)
+
+
+#-----------------------------------------------------------------------------------
+@_profiled(counted=False)
+def _run_highlight(buffer):
+    ''' Do one queued scan. Runs on the async thread. '''
+    with _sched_lock:
+        slots = _pending.pop(buffer.id(), None)
+
+    # Any view will do, they all show the same text.
+    view = buffer.primary_view()
+    if view is None or not view.is_valid():
+        return
+
+    on_done = None
+    cached = None
+    if slots is None:
+        slots = _get_slots(view)
+        if slots is None:
+            return
+        # Snapshot, the commands can change it on the UI thread.
+        slots = dict(slots)
+
+        # All slots of an unmodified file - maybe it was seen before.
+        fn = view.file_name()
+        if _get_setting('match_cache_mb') > 0 and fn is not None and not view.is_dirty():
+            cache = _get_match_cache()
+            try:
+                # Word lists can change without the slots changing.
+                key_vals = {k: dict(v, words_stamp=_file_stamp(v['words_file'])) if v.get('words_file') else v
+                            for k, v in slots.items()}
+                key = sbot_store.file_key(fn, key_vals)
+            except OSError:
+                key = None
+
+            if key is not None:
+                def cached():
+                    return cache.get(fn, key)
+
+                def on_done(hits):
+                    cache.put(fn, key, hits, _get_setting('match_cache_mb') * 1024 * 1024)
+
+    _highlight_view(view, slots, on_done, cached)
+
+
+#-----------------------------------------------------------------------------------
+def _file_stamp(fn):
+    ''' Changes when fn does. '''
+    stat = os.stat(fn)
+    return [stat.st_size, stat.st_mtime_ns]
 
-    # json uses string keys so convert to int.
-    hl_index = int(hl_index)
+
+#-----------------------------------------------------------------------------------
+def _highlight_view(view, slots, on_done=None, cached=None):
+    '''
+    Colorize all of slots, hl_index: tparams, with one read of the buffer. Call on the async thread.
+    on_done(hits) is called on the async thread with the complete results, unless some slots were over the limit.
+    cached() returns the hits from the match cache or None. Big views try it after showing the visible part.
+    '''
+    matcher = _Matcher(slots, _get_setting('max_matches_per_slot'))
+    if len(matcher.slots) == 0:
+        pass
+    elif _use_chunks(view):
+        _highlight_view_chunked(view, matcher, on_done, cached)
+    else:
+        gen = _get_state(view.buffer_id()).gen
+        change_count = view.change_count()
+        if cached is not None and _post_cached(view, gen, change_count, cached):
+            return
+        start = time.perf_counter()
+        text = view.substr(sublime.Region(0, view.size()))
+        hits = matcher.scan(text)
+        if len(matcher.failed) > 0:
+            _disable_slots(view, matcher.failed)
+        dense = {iind: matcher.over.get(iind, 0) for iind in hits}
+        _record_stat('scan', view.file_name(), _elapsed_ms(start), len(text), _hit_counts(hits, dense))
+
+        def stale():
+            # Edited while scanning. Try again when the typing settles.
+            sublime.set_timeout_async(lambda: _schedule_highlight(view, slots), _incremental_delay)
+
+        _post_hits(view, gen, change_count, hits, stale, dense)
+        if on_done is not None and len(matcher.over) == 0:
+            on_done(hits)
+
+
+#-----------------------------------------------------------------------------------
+def _post_cached(view, gen, change_count, cached):
+    ''' Show the hits from the match cache if there are any. Returns True if so. '''
+    start = time.perf_counter()
+    hits = cached()
+    if hits is None:
+        return False
+    dense = _split_dense(hits)
+    _record_stat('cached', view.file_name(), _elapsed_ms(start), view.size(), _hit_counts(hits, dense))
+    _post_hits(view, gen, change_count, hits, dense=dense)
+    return True
+
+
+#-----------------------------------------------------------------------------------
+def _use_chunks(view):
+    ''' Too big to do in one go? '''
+    return view.size() > _get_setting('chunk_threshold')
+
+
+#-----------------------------------------------------------------------------------
+def _highlight_view_chunked(view, matcher, on_done=None, cached=None):
+    ''' Colorize the visible part now then the rest from cached() or in time boxed slices on the async thread. '''
+    buffer = view.buffer()
+    bid = buffer.id()
+    bstate = _get_state(bid)
+    bstate.gen += 1
+    gen = bstate.gen
+
+    full_fn = view.file_name()
+    fn = os.path.basename(full_fn or '')
+    change_count = view.change_count()
+    size = view.size()
+
+    def post_visible(view):
+        # What the user is looking at. A huge single line is all visible so cap it.
+        vis = view.visible_region()
+        lo = max(0, vis.a - matcher.max_len)
+        hi = min(size, min(vis.b, vis.a + _dense_visible_max) + matcher.max_len)
+        _post_hits(view, gen, change_count, matcher.scan_region(view, lo, hi))
+        return vis.a, vis.b
+
+    # Scan position, last reported tenth, time spent so far, next chunk size and the visible part shown.
+    state = {'pos': 0, 'tenth': 0, 'busy': 0.0, 'chunk': _chunk_min, 'shown': post_visible(view)}
+    if cached is not None and _post_cached(view, gen, change_count, cached):
+        return
+
+    hits = {iind: [] for iind, _ in matcher.slots}
+    # Slots that went over the limit: hl_index: match count so far.
+    dense = {}
+
+    @_profiled(counted=False)
+    def do_slice():
+        # The starting view may have been closed, another view of the buffer will do.
+        view = buffer.primary_view()
+        if _scan_gen(bid) != gen or view is None:
+            # Cancelled.
+            return
+
+        if view.change_count() != change_count:
+            # Offsets are stale. Start over once the typing settles.
+            def restart():
+                view = buffer.primary_view()
+                if _scan_gen(bid) == gen and view is not None:
+                    _highlight_view_chunked(view, matcher, on_done)
+            sublime.set_timeout_async(restart, _incremental_delay * 4)
+            return
+
+        start_time = time.perf_counter()
+        pos = state['pos']
+        # Chunks take about half the budget, start them in the first half.
+        while pos < size and time.perf_counter() - start_time < _slice_budget / 2:
+            chunk_time = time.perf_counter()
+            end = min(size, pos + state['chunk'])
+            # Overlap the next chunk by the longest token. Keep only hits starting in this one.
+            hi = min(size, end + matcher.max_len)
+            for iind, found in matcher.scan_region(view, pos, hi, end).items():
+                if iind in matcher.failed:
+                    # Maybe in the visible part, before hits was made.
+                    continue
+                if iind in dense:
+                    dense[iind] += len(found) + matcher.over.get(iind, 0)
+                    continue
+                slot_hits = hits[iind]
+                last = slot_hits[-1][1] if len(slot_hits) > 0 else 0
+                for a, b in found:
+                    if a >= last:
+                        slot_hits.append((a, b))
+                        last = b
+                if iind in matcher.over or (matcher.limit > 0 and len(slot_hits) > matcher.limit):
+                    # Just count it from now on.
+                    dense[iind] = len(slot_hits) + matcher.over.get(iind, 0)
+                    hits[iind] = []
+            for iind in matcher.failed:
+                hits[iind] = []
+                dense.pop(iind, None)
+            rate = (end - pos) / max(time.perf_counter() - chunk_time, 1e-6)
+            state['chunk'] = max(_chunk_min, min(_chunk_size, int(rate * _slice_budget / 2)))
+            pos = end
+        state['pos'] = pos
+        state['busy'] += time.perf_counter() - start_time
+        if len(matcher.failed) > 0:
+            _disable_slots(view, matcher.failed)
+
+        if pos >= size:
+            # Busy time, not wall time - it yields between slices.
+            _record_stat('scan', full_fn, state['busy'] * 1000, size, _hit_counts(hits, dense))
+            _post_hits(view, gen, change_count, {iind: [] if iind in dense else found for iind, found in hits.items()},
+                       dense={iind: dense.get(iind, 0) for iind in hits})
+            if on_done is not None and len(dense) == 0:
+                on_done(hits)
+            sc.info(f'Highlighting {fn} done')
+            return
+
+        # All the regions are put up once at the end, repainting them all as it goes is slow. Until then
+        # just follow the visible part.
+        vis = view.visible_region()
+        if (vis.a, vis.b) != state['shown']:
+            state['shown'] = post_visible(view)
+        tenth = pos * 10 // size
+        if tenth > state['tenth']:
+            state['tenth'] = tenth
+            sc.info(f'Highlighting {fn} {tenth * 10}%')
+
+        sublime.set_timeout_async(do_slice, 0)
+
+    sublime.set_timeout_async(do_slice, 0)
+
+
+#-----------------------------------------------------------------------------------
+def _cancel_scans(view):
+    ''' Drop queued and running scans of the view's buffer, and any results not applied yet. '''
+    bid = view.buffer_id()
+    with _sched_lock:
+        _pending.pop(bid, None)
+    _get_state(bid).gen += 1
+
+
+#-----------------------------------------------------------------------------------
+def _post_hits(view, gen, change_count, hits, on_stale=None, dense=None):
+    '''
+    Apply scan results to all views of the buffer on the UI thread, unless cancelled or the buffer
+    changed since the scan. dense is dict of hl_index: match count for the slots scanned, 0 if under the limit.
+    '''
+    buffer = view.buffer()
+
+    def apply():
+        views = buffer.views()
+        if len(views) == 0 or _scan_gen(buffer.id()) != gen:
+            return
+        if views[0].change_count() != change_count:
+            if on_stale is not None:
+                on_stale()
+            return
+        for v in views:
+            _apply_hits(v, hits)
+        index = _get_index(views[0])
+        for iind, spans in hits.items():
+            index.set(iind, spans)
+        if dense is not None:
+            _set_dense(buffer, dense)
+        for v in views:
+            _update_status(v)
+
+    sublime.set_timeout(apply, 0)
+
+
+#-----------------------------------------------------------------------------------
+def _disable_slots(view, failed):
+    ''' Turn off regex slots that went over the time budget so they don't hold up every scan. Call from any thread. '''
+    fn = view.file_name()
+
+    def disable():
+        hl_vals = _hls.get(fn)
+        if hl_vals is None:
+            return
+        names = []
+        for iind in sorted(failed):
+            tparams = hl_vals.get(str(iind))
+            if tparams is not None and tparams.get('regex') and not tparams.get('disabled'):
+                tparams['disabled'] = True
+                names.append(f'HL {iind + 1}')
+        if len(names) > 0:
+            _persist(fn)
+            sc.info(f'Regex too slow, disabled {", ".join(names)}. Highlight again to retry.')
+
+    sublime.set_timeout(disable, 0)
+
+
+#-----------------------------------------------------------------------------------
+def _split_dense(hits):
+    ''' Blank the slots of hits over the limit. Returns dict of hl_index: match count, 0 if under. '''
+    limit = _get_setting('max_matches_per_slot')
+    dense = {}
+    for iind, spans in hits.items():
+        dense[iind] = len(spans) if limit > 0 and len(spans) > limit else 0
+        if dense[iind] > 0:
+            hits[iind] = []
+    return dense
+
+
+#-----------------------------------------------------------------------------------
+def _set_dense(buffer, dense):
+    ''' Update which slots of the buffer are over the limit. dense is from _post_hits(). Call on the UI thread. '''
+    state = _get_state(buffer.id())
+    before = set(state.dense)
+    for iind, count in dense.items():
+        if count > 0:
+            state.dense[iind] = count
+        else:
+            state.dense.pop(iind, None)
+    if set(state.dense) != before:
+        state.dense_matcher = None
+
+    if len(state.dense) > 0:
+        _start_dense_poll()
+
+    for view in buffer.views():
+        _show_visible(view)
+
+
+#-----------------------------------------------------------------------------------
+def _show_visible(view):
+    ''' Regions for the visible part of the dense slots of the view's buffer, and their counts in the status bar. '''
+    state = _states.get(view.buffer_id())
+    slots = _get_slots(view)
+    if state is None or len(state.dense) == 0 or slots is None:
+        if state is not None and state.shown.pop(view.id(), None) is not None:
+            _update_status(view)
+        return
+
+    vis = view.visible_region()
+    state.shown[view.id()] = (vis.a, vis.b, view.change_count())
+    if state.dense_matcher is None:
+        # Made once, this runs on every scroll.
+        state.dense_matcher = _Matcher({iind: tparams for iind, tparams in slots.items() if iind in state.dense})
+    matcher = state.dense_matcher
+    # A huge single line is all visible so cap it.
+    hi = min(vis.b, vis.a + _dense_visible_max)
+    hits = matcher.scan_region(view, max(0, vis.a - matcher.max_len), min(view.size(), hi + matcher.max_len))
+    _apply_hits(view, hits)
+    if len(matcher.failed) > 0:
+        _disable_slots(view, matcher.failed)
+
+    _update_status(view)
+
+
+#-----------------------------------------------------------------------------------
+def _start_dense_poll():
+    ''' Follow scrolling of views with dense slots. Runs until there are none. '''
+    global _dense_polling
+    if not _dense_polling:
+        _dense_polling = True
+        sublime.set_timeout(_poll_dense, _dense_poll_ms)
+
+
+#-----------------------------------------------------------------------------------
+def _poll_dense():
+    ''' Refresh the dense views that were scrolled or edited since last time. '''
+    global _dense_polling
+    if not any(len(state.dense) > 0 for state in _states.values()):
+        _dense_polling = False
+        return
+
+    for window in sublime.windows():
+        for view in window.views():
+            state = _states.get(view.buffer_id())
+            if state is not None and len(state.dense) > 0:
+                vis = view.visible_region()
+                if state.shown.get(view.id()) != (vis.a, vis.b, view.change_count()):
+                    _show_visible(view)
+
+    sublime.set_timeout(_poll_dense, _dense_poll_ms)
+
+
+#-----------------------------------------------------------------------------------
+def _copy_regions(view):
+    ''' Give a new view of a buffer the regions another view of it already has. No scan. '''
+    others = [v for v in view.buffer().views() if v.id() != view.id()]
+    if len(others) > 0:
+        for hl in sc.get_highlight_info('user'):
+            regions = others[0].get_regions(hl.region_name)
+            if len(regions) > 0:
+                view.add_regions(hl.region_name, regions, hl.scope_name)
+
+
+#-----------------------------------------------------------------------------------
+def _apply_hits(view, hits):
+    ''' Push scan results to the view. hits is dict of hl_index: [(start, end), ...]. '''
+    hl_info = sc.get_highlight_info('user')
+    for iind, spans in hits.items():
+        hl = hl_info[iind]
+        if len(spans) > 0:
+            view.add_regions(hl.region_name, [sublime.Region(a, b) for a, b in spans], hl.scope_name)
+        else:
+            # Token changed to something not in the view.
+            view.erase_regions(hl.region_name)
+
+
+#-----------------------------------------------------------------------------------
+def _get_index(view):
+    ''' The match offsets of the view's buffer. If there were edits since, they are read again from the regions, which ST moves with the text. '''
+    state = _get_state(view.buffer_id())
+    if state.index is None or state.index.change_count != view.change_count():
+        state.index = _HitIndex(view.change_count())
+        for iind, hl in enumerate(sc.get_highlight_info('user')):
+            state.index.set(iind, [(r.a, r.b) for r in view.get_regions(hl.region_name)])
+    return state.index
+
+
+#-----------------------------------------------------------------------------------
+def _scan_next(view, iind, tparams, pt, forward):
+    ''' Like _HitIndex.next() for a dense slot, which only has regions in the visible part. Scans out from pt a window at a time. '''
+    matcher = _Matcher({iind: tparams})
+    size = view.size()
+    if forward:
+        a = max(0, pt + 1)
+        while a < size:
+            b = min(size, a + _dense_visible_max)
+            found = matcher.scan_region(view, a, min(size, b + matcher.max_len), b).get(iind)
+            if found:
+                return found[0]
+            a = b
+    else:
+        b = min(size, pt)
+        while b > 0:
+            a = max(0, b - _dense_visible_max)
+            found = matcher.scan_region(view, a, min(size, b + matcher.max_len), b).get(iind)
+            if found:
+                return found[-1]
+            b = a
+    return None
+
+
+#-----------------------------------------------------------------------------------
+def _update_status(view):
+    ''' Match counts in the status bar. Cheap, the counts come from the index as it is. '''
+    state = _states.get(view.buffer_id())
+    if state is None:
+        return
+    dense = state.dense
+    counts = {}
+    if state.index is not None:
+        counts.update((iind, len(starts)) for iind, starts in state.index.starts.items() if len(starts) > 0)
+    counts.update(dense)
+    if len(counts) == 0:
+        view.erase_status(_hits_status)
+        return
+
+    text = ' '.join(f'HL{iind + 1}:{count}{"*" if iind in dense else ""}' for iind, count in sorted(counts.items()))
+    if len(dense) > 0:
+        text += ' (* visible part only)'
+    view.set_status(_hits_status, text)
+
+
+#-----------------------------------------------------------------------------------
+def _search_folders(gen, rview, folders, patterns, exclude_dirs, exclude_files, max_bytes):
+    ''' Project search worker. Walks the folders and streams results to rview as each file finishes. '''
+    lock = threading.Lock()
+    # Files with hits, total hits.
+    counts = [0, 0]
+    # Regex tokens that went over the time budget, they are skipped from then on.
+    failed = set()
+
+    def post(text):
+        sublime.set_timeout(lambda: rview.run_command('append', {'characters': text}), 0)
+
+    def report(future):
+        lines = future.result()
+        if len(lines) > 0 and gen == _search_gen:
+            with lock:
+                counts[0] += 1
+                counts[1] += len(lines)
+                post('\n'.join(lines) + '\n')
+
+    # Only needed here, not worth its import time at startup.
+    import concurrent.futures
+
+    # Threads rather than processes, the ST plugin host can't start python subprocesses.
+    # The files are mmapped and re runs on the raw bytes.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as pool:
+        for folder in folders:
+            for root, dirs, files in os.walk(folder):
+                if gen != _search_gen:
+                    # A new search started.
+                    return
+                dirs[:] = [d for d in dirs if not any(fnmatch.fnmatch(d, p) for p in exclude_dirs)]
+                for fn in files:
+                    if not any(fnmatch.fnmatch(fn, p) for p in exclude_files):
+                        future = pool.submit(_search_file, gen, os.path.join(root, fn), patterns, max_bytes, failed)
+                        future.add_done_callback(report)
+
+    if gen == _search_gen:
+        post(f'\n{counts[1]} hits in {counts[0]} files\n')
+        if len(failed) > 0:
+            post(f'Regex too slow, skipped {", ".join(token for token, _, _ in patterns if token in failed)}\n')
+
+
+#-----------------------------------------------------------------------------------
+def _search_file(gen, path, patterns, max_bytes, failed):
+    '''
+    Find patterns in one file. patterns is list of (token, bytes regex, is regex). Regex tokens get the same time
+    budget as in the views, the ones over it are added to failed. Returns list of result lines.
+    '''
+    lines = []
+    if gen != _search_gen:
+        return lines
+
+    try:
+        size = os.path.getsize(path)
+        if size == 0 or size > max_bytes:
+            return lines
+
+        with open(path, 'rb') as fp:
+            # Looks like binary.
+            if b'\0' in fp.read(8192):
+                return lines
+
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                found = []
+                for token, pattern, timed in patterns:
+                    if token in failed:
+                        continue
+                    if timed:
+                        # Thread time, the other workers hold the GIL part of the time.
+                        starts = [m.start() for m in _budgeted(pattern, mm, 0, failed, token, time.thread_time)]
+                        if token not in failed:
+                            found.extend((pos, token) for pos in starts)
+                    else:
+                        found.extend((m.start(), token) for m in pattern.finditer(mm))
+                found.sort()
+
+                # Walk forward counting lines.
+                line_num = 1
+                last = 0
+                for pos, token in found:
+                    line_num += mm[last:pos].count(b'\n')
+                    last = pos
+                    start = mm.rfind(b'\n', 0, pos) + 1
+                    end = mm.find(b'\n', pos)
+                    end = size if end < 0 else end
+                    text = mm[start:min(end, start + 200)].decode('utf-8', errors='replace').rstrip()
+                    lines.append(f'{path}:{line_num}:{pos - start + 1}: [{token}] {text}')
+    except (OSError, ValueError) as e:
+        sc.debug(f'Search skipped {path}: {e}')
+
+    return lines
+
+
+#-----------------------------------------------------------------------------------
+def export_html(fn, hl_vals, out_fn, styles):
+    '''
+    Write file fn to out_fn as html with the hl_vals slots highlighted. styles is scope: style as from
+    view.style_for_scope(), for 'text' and the user highlight scopes. fn is read and scanned a chunk at a time
+    so memory use doesn't depend on its size. Where hits overlap the first one wins. Returns hits per slot.
+    '''
+    matcher = _Matcher({int(k): v for k, v in hl_vals.items()})
     hl_info = sc.get_highlight_info('user')
+    counts = {iind: 0 for iind, _ in matcher.slots}
+
+    css = [f'body {{ {_style_css(styles["text"])} }}', 'pre { font-family: monospace; }']
+    css.extend(f'.hl{iind + 1} {{ {_style_css(styles[hl_info[iind].scope_name])} }}' for iind in counts)
+    title = os.path.basename(fn).translate(_html_escapes)
+
+    os.makedirs(os.path.dirname(out_fn), exist_ok=True)
+    with open(fn, 'r', encoding='utf-8', errors='replace') as fin, open(out_fn, 'w', encoding='utf-8') as fout:
+        fout.write(f'<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>{title}</title>\n<style>\n')
+        fout.write('\n'.join(css))
+        fout.write('\n</style>\n</head>\n<body>\n<pre>')
+
+        # Char before the unwritten text, for the whole word tests. Then the unwritten text.
+        prev = ''
+        carry = ''
+        while True:
+            chunk = fin.read(_chunk_size)
+            text = prev + carry + chunk
+            pos = len(prev)
+            # Hits must start before stop so the longest token still fits. The rest is done with the next chunk.
+            stop = len(text) if len(chunk) == 0 else max(pos, len(text) - matcher.max_len)
+
+            found = sorted((a, iind, b) for iind, spans in matcher.scan(text, 0, pos, stop).items() for a, b in spans)
+            # Most chunks have nothing to escape so skip the per piece translate.
+            escape = '&' in text or '<' in text or '>' in text
+            out = []
+            for a, iind, b in found:
+                if a < pos:
+                    # Overlaps the one before.
+                    continue
+                before = text[pos:a]
+                token = text[a:b]
+                if escape:
+                    before = before.translate(_html_escapes)
+                    token = token.translate(_html_escapes)
+                out.append(before)
+                out.append(f'<span class=hl{iind + 1}>{token}</span>')
+                counts[iind] += 1
+                pos = b
+            stop = max(stop, pos)
+            out.append(text[pos:stop].translate(_html_escapes) if escape else text[pos:stop])
+            fout.write(''.join(out))
+
+            if len(chunk) == 0:
+                break
+            prev = text[stop - 1:stop]
+            carry = text[stop:]
 
-    if hl_index < len(hl_info):
-        highlight_regions = view.find_all(escaped) if whole_word else view.find_all(token, sublime.LITERAL)
-        if len(highlight_regions) > 0:
-            hl = hl_info[hl_index]
-            view.add_regions(hl.region_name, highlight_regions, hl.scope_name)
+        fout.write('</pre>\n</body>\n</html>\n')
+
+    return counts
+
+
+#-----------------------------------------------------------------------------------
+def _export_files(files, out_dir, styles, out_fn=None):
+    ''' Export files, list of (fn, hl_vals), into out_dir with a pool of workers. Or just one to out_fn. Blocks. '''
+    import concurrent.futures
+
+    def export(fn, hl_vals):
+        if out_fn is not None:
+            dest = out_fn
+        else:
+            # Same names in different dirs.
+            dest = os.path.join(out_dir, f'{os.path.basename(fn)}_{hashlib.sha1(fn.encode()).hexdigest()[:8]}.html')
+        start = time.perf_counter()
+        counts = export_html(fn, hl_vals, dest, styles)
+        _record_stat('export', fn, _elapsed_ms(start), os.path.getsize(fn), {iind + 1: n for iind, n in counts.items()})
+        return dest
+
+    done = []
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as pool:
+        futures = {pool.submit(export, fn, hl_vals): fn for fn, hl_vals in files}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                done.append(future.result())
+            except (OSError, re.error) as e:
+                failed += 1
+                sc.debug(f'Export skipped {futures[future]}: {e}')
+            if len(files) > 1:
+                sublime.status_message(f'Exported {len(done) + failed} of {len(files)}')
+
+    if len(files) == 1 and len(done) == 1:
+        sc.info(f'Exported to {done[0]}')
     else:
-        sc.error(f'Invalid scope index {hl_index}')
+        skipped = f', {failed} skipped, see the log' if failed > 0 else ''
+        sc.info(f'Exported {len(done)} files to {out_dir}{skipped}')
+
+
+#-----------------------------------------------------------------------------------
+def _export_styles(view):
+    ''' Styles export_html() needs, from the view's color scheme. '''
+    scopes = ['text'] + [hl.scope_name for hl in sc.get_highlight_info('user')]
+    return {scope: _get_style(view, scope) for scope in scopes}
+
+
+#-----------------------------------------------------------------------------------
+def _style_css(style):
+    ''' css properties for a style from view.style_for_scope(). '''
+    props = [f'color:{style["foreground"]};']
+    if 'background' in style:
+        props.append(f'background-color:{style["background"]};')
+    if style.get('bold'):
+        props.append('font-weight:bold;')
+    if style.get('italic'):
+        props.append('font-style:italic;')
+    return ' '.join(props)
+
+
+#-----------------------------------------------------------------------------------
+def _merge_hits(views, hits, cores):
+    '''
+    Replace the regions touching cores with the new hits, keep the rest. cores is sorted list of (start, end).
+    views all show the same buffer so the merge is done once from the first.
+    '''
+    hl_info = sc.get_highlight_info('user')
+    starts = [a for a, _ in cores]
+    index = _get_index(views[0])
+
+    def touches(r):
+        # Last core starting at or before the region end. Cores are whole lines so their ends are sorted too.
+        i = bisect.bisect_right(starts, r.b)
+        return i > 0 and cores[i - 1][1] >= r.a
+
+    for iind, new in hits.items():
+        hl = hl_info[iind]
+        kept = [(r.a, r.b) for r in views[0].get_regions(hl.region_name) if not touches(r)]
+        spans = sorted(kept + new)
+        index.set(iind, spans)
+        regions = [sublime.Region(a, b) for a, b in spans]
+        for view in views:
+            if len(regions) > 0:
+                view.add_regions(hl.region_name, regions, hl.scope_name)
+            else:
+                view.erase_regions(hl.region_name)
+
+    for view in views:
+        _update_status(view)
+
+
+#-----------------------------------------------------------------------------------
+def _get_store():
+    ''' The persistence backend. '''
+    global _store
+    if _store is None:
+        _store = sbot_store.HighlightStore(sc.get_store_fn())
+    return _store
+
+
+#-----------------------------------------------------------------------------------
+def _get_match_cache():
+    ''' The scan results cache. '''
+    global _match_cache
+    if _match_cache is None:
+        _match_cache = sbot_store.MatchCache(sc.get_store_fn())
+    return _match_cache
+
+
+#-----------------------------------------------------------------------------------
+def _persist(fn):
+    ''' The entry for fn changed. It is saved shortly with any others. Cached scan results for it are dropped. '''
+    if fn is None:
+        return
+    _get_match_cache().drop(fn)
+    if fn not in _hls:
+        _access.pop(fn, None)
+    _slots_changed(fn)
+    _dirty.add(fn)
+    _schedule_save()
+
+    max_files = _get_setting('store_max_files')
+    if max_files and len(_hls) + _get_store().unread_files() > max_files:
+        _evict_store()
+
+
+#-----------------------------------------------------------------------------------
+def _evict_store():
+    '''
+    Drop the least recently used files when over the store limits. Whole shards that haven't been read go first,
+    then files of the ones read. Picked on a worker thread, dropped on the UI thread.
+    '''
+    global _evicting
+    max_files = _get_setting('store_max_files')
+    max_days = _get_setting('store_max_days')
+    if _evicting or not (max_files or max_days):
+        return
+
+    store = _get_store()
+    # Only the count limit needs the slack. Under it, 0 is no limit.
+    keep = int(max_files * (1 - _evict_slack)) if max_files and len(_hls) + store.unread_files() > max_files else 0
+    max_age = max_days * 86400 if max_days else 0
+    now = int(time.time())
+    access = [(_access.get(fn, now), fn) for fn in _hls]
+    _evicting = True
+
+    def pick():
+        try:
+            unread = store.evict_shards(keep, max_age, now, len(access))
+            # What the read ones may have.
+            fns = sbot_store.pick_evictions(access, max(keep - unread, 1) if keep else 0, max_age, now)
+        except Exception as e:
+            fns = []
+            sc.error(f'Error picking store evictions: {e}', e.__traceback__)
+        used = dict((fn, at) for at, fn in access) if len(fns) > 0 else {}
+        sublime.set_timeout(lambda: drop([(fn, used[fn]) for fn in fns]), 0)
+
+    def drop(picked):
+        global _evicting
+        _evicting = False
+        # Not ones that were used since they were picked, or are open.
+        open_fns = set(view.file_name() for window in sublime.windows() for view in window.views())
+        fns = [fn for fn, at in picked if fn in _hls and _access.get(fn, now) == at and fn not in open_fns]
+        if len(fns) == 0:
+            return
+
+        for fn in fns:
+            del _hls[fn]
+            _access.pop(fn, None)
+            _dirty.add(fn)
+        _schedule_save()
+        sc.debug(f'Evicted {len(fns)} least recently used files from the store')
+
+    threading.Thread(target=pick, daemon=True).start()
+
+
+#-----------------------------------------------------------------------------------
+def _schedule_save():
+    ''' Debounced save of the changed files. '''
+    global _save_gen
+    _save_gen += 1
+    gen = _save_gen
+    sublime.set_timeout(lambda: _autosave(gen), _save_delay)
+
+
+#-----------------------------------------------------------------------------------
+def _autosave(gen):
+    ''' Save if there were no changes since this was scheduled. The records are made here, written on the async thread. '''
+    if gen != _save_gen or (len(_dirty) == 0 and len(_unsynced) == 0):
+        return
+    _take_dirty()
+    access = dict(_access)
+    folders = _open_folders()
+    sublime.set_timeout_async(lambda: _sync_store(access, folders), 0)
+
+
+#-----------------------------------------------------------------------------------
+def _take_dirty():
+    ''' Add journal records of the changed files to _unsynced. Clears the changes. '''
+    # Copies, the commands can change the slots while they are written.
+    records = [sbot_store.make_record(fn, {k: dict(v) for k, v in _hls[fn].items()} if fn in _hls else None, _access.get(fn))
+               for fn in _dirty]
+    _dirty.clear()
+    with _unsynced_lock:
+        _unsynced.extend(records)
+
+
+#-----------------------------------------------------------------------------------
+@_profiled(counted=False)
+def _sync_store(access, folders):
+    ''' Write the unsynced records and pick up the changes other ST instances made. Runs on the async thread. '''
+    store = _get_store()
+    start = time.perf_counter()
+    with _sync_lock:
+        # The ones taken since are written too. Later saves may find nothing left.
+        with _unsynced_lock:
+            records = list(_unsynced)
+        try:
+            full, others = store.sync(records, access, folders=folders)
+            with _unsynced_lock:
+                del _unsynced[:len(records)]
+            _record_stat('save_store', store.index_fn, _elapsed_ms(start), len(records))
+        except Exception as e:
+            sc.error(f'Error writing {store.index_fn}: {e}', e.__traceback__)
+            # They stay unsynced for the next save.
+            sublime.set_timeout(_schedule_save, 0)
+            return
+
+    written = set(record['fn'] for record in records)
+    if len(full) > 0 or len(others) > 0:
+        sublime.set_timeout(lambda: _merge_store(full, others, written), 0)
+
+
+#-----------------------------------------------------------------------------------
+def _merge_store(full, others, written):
+    '''
+    Take in the changes other ST instances saved. This instance's changes win for the files it wrote in the
+    same save or changed since. full is the store shards that were read again, with None for the files left in no
+    shard when another instance removed some. others is the new records of the rest.
+    '''
+    skip = _dirty | written
+    changed = set()
+    if len(full) > 0:
+        store = _get_store()
+        shards = collections.defaultdict(set)
+        for fn in _hls:
+            shards[store.shard_of(fn)].add(fn)
+        for name, (hls, access) in full.items():
+            for fn in shards[name] | set(hls):
+                if fn not in skip and _hls.get(fn) != hls.get(fn):
+                    sbot_store.apply_record(_hls, _access, sbot_store.make_record(fn, hls.get(fn), access.get(fn)))
+                    changed.add(fn)
+            for fn, at in access.items():
+                if fn in _hls and at > _access.get(fn, 0):
+                    _access[fn] = at
+
+    for record in others:
+        if record['fn'] not in skip:
+            sbot_store.apply_record(_hls, _access, record)
+            changed.add(record['fn'])
+
+    if len(changed) == 0:
+        return
+    sc.debug(f'Merged {len(changed)} files changed by another instance')
+
+    # Redo the open ones.
+    hl_info = sc.get_highlight_info('user')
+    done = set()
+    for window in sublime.windows():
+        for view in window.views():
+            if view.file_name() not in changed or view.buffer_id() in done:
+                continue
+            done.add(view.buffer_id())
+            _get_match_cache().drop(view.file_name())
+            _cancel_scans(view)
+            _get_state(view.buffer_id()).clear()
+            for v in view.buffer().views():
+                for hl in hl_info:
+                    v.erase_regions(hl.region_name)
+                v.erase_status(_hits_status)
+            if view.file_name() in _hls:
+                _schedule_highlight(view)
+
+
+#-----------------------------------------------------------------------------------
+def _load_shard(fn):
+    ''' Read the store shard fn is in, if that hasn't been done, and check its files in the background. '''
+    store = _get_store()
+    start = time.perf_counter()
+    try:
+        loaded = store.load_file(fn)
+    except Exception as e:
+        sc.error(f'Error reading {store.index_fn}: {e}', e.__traceback__)
+        return
+    if loaded is None:
+        return
+
+    hls, access = loaded
+    for sfn, vals in hls.items():
+        # Not ones removed here and not saved yet.
+        if len(vals) > 0 and sfn not in _hls and sfn not in _dirty:
+            _hls[sfn] = vals
+            _access[sfn] = access[sfn]
+    _record_stat('read_shard', fn, _elapsed_ms(start), len(hls))
+    _check_store(list(hls))
+    _evict_store()
+
+
+#-----------------------------------------------------------------------------------
+def _check_store(fns):
+    ''' Prune the ones of fns that are gone, in the background. '''
+    global _validated, _validating
+    if _validated is None:
+        _validated = set()
+    _validating += 1
+    threading.Thread(target=lambda: _validate_store(fns), daemon=True).start()
+
+
+#-----------------------------------------------------------------------------------
+def _validate_store(fns):
+    ''' Find stored files that are gone then drop them on the UI thread. Runs on a worker thread. '''
+    missing = sbot_store.find_missing(fns)
+
+    def prune():
+        global _validated, _validating
+        for fn in missing:
+            if fn in _hls and fn not in _validated:
+                del _hls[fn]
+                _persist(fn)
+        if len(missing) > 0:
+            sc.debug(f'Pruned {len(missing)} missing files from the store')
+        # Done with it when no other check is running. Otherwise it grows with every file opened.
+        _validating -= 1
+        if _validating == 0:
+            _validated = None
+
+    sublime.set_timeout(prune, 0)
+
+
+#-----------------------------------------------------------------------------------
+def _record_stat(op, fn, msecs, size=0, counts=None):
+    ''' Add one timed operation to the stats. Slow ones are logged too. '''
+    _stats.append(_OpStat(time.time(), op, fn, size, msecs, counts))
+
+    slow_ms = _get_setting('slow_op_ms')
+    if slow_ms and msecs >= slow_ms:
+        sc.debug(f'Slow {op} {fn}: {msecs:.1f} ms size:{size} matches:{counts}')
+
+
+#-----------------------------------------------------------------------------------
+def _end_profile(capture):
+    ''' Stop capturing and write the combined profile and its summary. '''
+    global _profile
+    with _profile_lock:
+        if _profile is not capture:
+            # Already written.
+            return
+        _profile = None
+        profiles = capture.profiles[:]
+        ops = capture.ops[:]
+
+    if len(profiles) == 0:
+        sc.info('Profiling stopped, nothing was captured')
+        return
+
+    import io
+    import pstats
+    base = os.path.join(sc.get_store_path(), time.strftime('profile_%Y%m%d_%H%M%S'))
+    try:
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(base + '.pstats')
+
+        out = io.StringIO()
+        out.write(f'{len(ops)} calls, {sum(op[2] for op in ops):.1f} ms\n')
+        for func, fn, msecs in sorted(ops, key=lambda op: op[2], reverse=True):
+            out.write(f'{msecs:10.1f} ms  {func} {fn or ""}\n')
+        stats.stream = out
+        stats.strip_dirs()
+        out.write('\nMost time in the function itself\n')
+        stats.sort_stats('tottime').print_stats(_profile_top)
+        out.write('\nMost time including what it calls\n')
+        stats.sort_stats('cumulative').print_stats(_profile_top)
+
+        with open(base + '.txt', 'w') as fp:
+            fp.write(out.getvalue())
+        sc.info(f'Profile of {len(ops)} calls written to {base}.txt')
+    except Exception as e:
+        sc.error(f'Error writing {base}: {e}', e.__traceback__)
+
+
+#-----------------------------------------------------------------------------------
+def _op_file(args):
+    ''' File of the view or buffer a profiled call is about, if there is one. '''
+    for arg in args:
+        for obj in [arg, getattr(arg, 'view', None), getattr(arg, 'buffer', None)]:
+            if isinstance(obj, (sublime.View, sublime.Buffer)):
+                return obj.file_name()
+    return None
+
+
+#-----------------------------------------------------------------------------------
+def _elapsed_ms(start):
+    ''' Msec since start, which is from time.perf_counter(). '''
+    return (time.perf_counter() - start) * 1000
+
+
+#-----------------------------------------------------------------------------------
+def _hit_counts(hits, dense=None):
+    ''' Matches per slot for the stats. Keys are HL numbers as the user sees them. dense has the counts of blanked slots. '''
+    counts = {iind + 1: len(spans) for iind, spans in hits.items()}
+    if dense is not None:
+        counts.update((iind + 1, count) for iind, count in dense.items() if count > 0)
+    return counts
+
+
+#-----------------------------------------------------------------------------------
+def _get_setting(name):
+    ''' Read one of our settings. '''
+    settings = sublime.load_settings(sc.get_settings_fn())
+    return settings.get(name)
 
 
 #-----------------------------------------------------------------------------------
@@ -310,6 +2382,10 @@ def _get_hl_vals(view, init):
     vals = None
     fn = view.file_name()
 
+    if fn is not None and fn not in _hls:
+        # Its shard may not have been read yet.
+        _load_shard(fn)
+
     if fn not in _hls:
         if init:
             # Add a new one.
@@ -318,66 +2394,202 @@ def _get_hl_vals(view, init):
     else:
         vals = _hls[fn]
 
+    if vals is not None:
+        # Saved with the next snapshot.
+        _access[fn] = int(time.time())
+
     return vals
 
 
 #-----------------------------------------------------------------------------------
-def _render_scopes(scopes, view):
-    ''' Make popup for list of scopes. '''
-    style_text = []
-    content = []
-    short_content = []
+def _open_folders():
+    ''' Project folders of all the windows. '''
+    return [folder for window in sublime.windows() for folder in window.folders()]
+
+
+#-----------------------------------------------------------------------------------
+def _get_state(bid):
+    ''' State of an open buffer, made if there is none. '''
+    state = _states.get(bid)
+    if state is None:
+        state = _states.setdefault(bid, _BufferState())
+    return state
+
+
+#-----------------------------------------------------------------------------------
+def _scan_gen(bid):
+    ''' Current scan generation of a buffer. None once it's closed so anything still running for it is cancelled. '''
+    state = _states.get(bid)
+    return None if state is None else state.gen
+
+
+#-----------------------------------------------------------------------------------
+def _get_slots(view):
+    ''' The view's slots as hl_index: tparams, or None if it has none. Converted from _hls once per change. '''
+    hl_vals = _get_hl_vals(view, init=False)
+    if hl_vals is None:
+        return None
+    state = _get_state(view.buffer_id())
+    if state.slots is None:
+        state.slots = {int(k): v for k, v in hl_vals.items()}
+    return state.slots
+
+
+#-----------------------------------------------------------------------------------
+def _slots_changed(fn):
+    ''' The slots of fn changed. Forget what was made from the old ones. '''
+    for window in sublime.windows():
+        for view in window.views():
+            state = _states.get(view.buffer_id())
+            if state is not None and view.file_name() == fn:
+                state.slots = None
+                state.dense_matcher = None
+
 
-    for scope in scopes:
+#-----------------------------------------------------------------------------------
+def _get_style(view, scope):
+    ''' view.style_for_scope() remembered per color scheme. '''
+    styles = _styles.setdefault(view.settings().get('color_scheme'), {})
+    style = styles.get(scope)
+    if style is None:
         style = view.style_for_scope(scope)
-        props = f'{{ color:{style["foreground"]}; '
-        props2 = f'fg:{style["foreground"]} '
+        styles[scope] = style
+    return style
+
+
+#-----------------------------------------------------------------------------------
+def _on_prefs_change():
+    ''' Preferences changed, maybe the color scheme. '''
+    global _last_schemes
+    prefs = sublime.load_settings('Preferences.sublime-settings')
+    schemes = [prefs.get(name) for name in _scheme_prefs]
+    if schemes != _last_schemes:
+        _last_schemes = schemes
+        _color_scheme_changed()
+
+
+#-----------------------------------------------------------------------------------
+def _color_scheme_changed():
+    ''' Forget the old styles and give the open views' regions the new colors. '''
+    _styles.clear()
+    _scope_parts.clear()
+    _scope_popups.clear()
+    views = [view for window in sublime.windows() for view in window.views() if view.file_name() in _hls]
+    # Let ST apply the new scheme first.
+    sublime.set_timeout(lambda: _reapply_regions(views), 0)
+
+
+#-----------------------------------------------------------------------------------
+def _reapply_regions(views):
+    ''' Add the existing regions again so they pick up the scheme colors. No rescan. A batch of views per UI tick. '''
+    hl_info = sc.get_highlight_info('user')
+    for view in views[:_reapply_batch]:
+        if view.is_valid():
+            for hl in hl_info:
+                regions = view.get_regions(hl.region_name)
+                if len(regions) > 0:
+                    view.add_regions(hl.region_name, regions, hl.scope_name)
+
+    if len(views) > _reapply_batch:
+        sublime.set_timeout(lambda: _reapply_regions(views[_reapply_batch:]), 0)
+
+
+#-----------------------------------------------------------------------------------
+def _get_all_scopes(view):
+    ''' Scopes for sbot_all_scopes. Made once per syntax kind and scopes_to_show. '''
+    syntax = view.syntax()
+    notr = view.file_name() is not None and syntax is not None and syntax.name == 'Notr'
+    # User requests?
+    extra_scopes = tuple(_get_setting('scopes_to_show') or [])
+    key = (notr, extra_scopes)
+
+    scopes = _all_scopes.get(key)
+    if scopes is None:
+        scopes = []
+        if notr:
+            scopes.extend(_notr_scopes)
+        scopes.extend(_markup_scopes)
+        scopes.extend(_internal_scopes)
+        scopes.extend(_syntax_scopes)
+        scopes.extend(_generic_colors_scopes)
+        scopes.extend(extra_scopes)
+        scopes = tuple(scopes)
+        _all_scopes[key] = scopes
+    return scopes
+
+
+#-----------------------------------------------------------------------------------
+def _get_scope_part(view, scheme, scope):
+    ''' css and text line for one scope in a popup, remembered per color scheme. '''
+    parts = _scope_parts.setdefault(scheme, {})
+    part = parts.get(scope)
+    if part is None:
+        style = _get_style(view, scope)
+        props = f'fg:{style["foreground"]} '
         if 'background' in style:
-            props += f'background-color:{style["background"]}; '
-            props2 += f'bg:{style["background"]} '
-        if style['bold']:
-            props += 'font-weight:bold; '
-            props2 += 'bold '
-        if style['italic']:
-            props += 'font-style:italic; '
-            props2 += 'italic '
-        props += '}'
-
-        i = len(style_text)
-        style_text.append(f'.st{i} {props}')
-        content.append(f'<p><span class=st{i}>{scope}  {props2}</span></p>')
-        short_content.append(f'{scope}  {props2}')
-
-    # Do popup
-    st = '\n'.join(style_text)
-    ct = '\n'.join(content)
-    sc = '\n'.join(short_content)
-
-    # Html for popup.
-    html = f'''
+            props += f'bg:{style["background"]} '
+        if style.get('bold'):
+            props += 'bold '
+        if style.get('italic'):
+            props += 'italic '
+        part = (_style_css(style), f'{scope}  {props}')
+        parts[scope] = part
+    return part
+
+
+#-----------------------------------------------------------------------------------
+def _render_scopes(scopes, view):
+    ''' Make popup for list of scopes. The same scopes in the same color scheme reuse the last one. '''
+    scheme = view.settings().get('color_scheme')
+    key = (scheme, tuple(scopes))
+    popup = _scope_popups.get(key)
+
+    if popup is None:
+        # One class per distinct style.
+        classes = {}
+        style_text = []
+        content = []
+        short_content = []
+
+        for scope in scopes:
+            css, line = _get_scope_part(view, scheme, scope)
+            i = classes.get(css)
+            if i is None:
+                i = len(style_text)
+                classes[css] = i
+                style_text.append(f'.st{i} {{ {css} }}')
+            content.append(f'<p><span class=st{i}>{line}</span></p>')
+            short_content.append(line)
+
+        st = '\n'.join(style_text)
+        ct = '\n'.join(content)
+
+        # Html for popup.
+        html = f'''
 <body>
 <style> p {{ margin: 0em; }} {st} </style>
 {ct}
 </body>
 <a href="copy_scopes">Copy To Clipboard</a>
 '''
+        popup = (html, '\n'.join(short_content))
+        _scope_popups[key] = popup
+        if len(_scope_popups) > _scope_popups_size:
+            _scope_popups.popitem(last=False)
+    else:
+        _scope_popups.move_to_end(key)
 
-    to_show = '\n'.join(scopes)
+    html, text = popup
 
     # Callback
     def nav(href):
         ''' Copy to clipboard. '''
-        to_html = f'''
-<body>
-<style> p {{ margin: 0em; }} {st} </style>
-{ct}
-</body>
-'''
-
-        # sublime.set_clipboard(to_html)
-        # sublime.set_clipboard(to_show)
-        sublime.set_clipboard(sc)
+        sublime.set_clipboard(text)
         view.hide_popup()
         sublime.status_message('Scopes copied to clipboard')
 
     view.show_popup(html, max_width=512, max_height=600, on_navigate=nav)
+
+
+# Must be last.
+_import_msecs = _elapsed_ms(_import_start)
@@ -0,0 +1,816 @@
+import os
+import json
+import math
+import bisect
+import time
+import hashlib
+import threading
+from . import sbot_common as sc
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+#-----------------------------------------------------------------------------------
+# Persistence for the highlights. The files are split into shards, one per project
+# folder, so only the shards of the projects in use are read. A file outside of any
+# project folder goes in a shard for its own dir. An index file lists the shards.
+#
+# Each shard is a snapshot file plus a journal of each change since then, appended
+# as one json line. Loading reads the snapshot then replays the journal. When the
+# journal gets long it is folded back into a new snapshot.
+#
+# Journal records:
+#   {"fn": "path", "hls": {...}, "at": 1700000000}   set the entry for a file, used at
+#   {"fn": "path", "hls": null}                      remove the entry for a file
+#
+# The snapshot also has the last time each file was used so the least recently used
+# can be evicted. Plain reads of an entry only update that in memory, it is saved with
+# the next snapshot. The index has the file count and last use of each shard as of its
+# last snapshot, so shards that aren't read can be evicted whole.
+#
+# Several ST instances can share the store. All reads and writes are done holding a
+# lock file. Each instance remembers how far into each journal it has read and which
+# snapshot it read it on top of. A sync picks up the records the others appended since,
+# then appends its own. If another instance folded the journal in the meantime, the
+# snapshot is different and the whole shard is read again.
+#-----------------------------------------------------------------------------------
+
+# Snapshot format version. The legacy flat json file is 1. 2 has no access times.
+_store_version = 3
+
+# Index format version.
+_index_version = 1
+
+# Fold the journal into the snapshot after this many records.
+_compact_after = 500
+
+# Seconds one existence check may take before its volume or file is treated as unreachable.
+_check_timeout = 2.0
+
+# Parallel existence checks.
+_check_workers = 8
+
+
+#-----------------------------------------------------------------------------------
+class HighlightStore:
+    ''' Sharded snapshot plus journal store. All writes are atomic or append only so a crash loses nothing written. '''
+
+    def __init__(self, store_fn):
+        ''' store_fn is the legacy json file. The new files live next to it. '''
+        base, _ = os.path.splitext(store_fn)
+        self.legacy_fn = store_fn
+        self.index_fn = base + '.index'
+        self.shard_dir = base + '.shards'
+        self.lock_fn = base + '.lock'
+        # The single snapshot and journal of the last version. Split into shards on first load.
+        self._unsharded = _Shard(base)
+        # Shard name: {'root': dir, 'folder': bool, 'files': count, 'used': secs}. Folder shards have the files
+        # anywhere under root, the others just the ones in root.
+        self._index = {}
+        self._index_id = None
+        self._index_changed = False
+        # Normalized root: shard name, for each kind.
+        self._folder_roots = {}
+        self._dir_roots = {}
+        # fn: shard name for the files in the last sync. Emptied when the roots change.
+        self._found = {}
+        # Shards used so far by name, and the ones that have been read.
+        self._shards = {}
+        self._loaded = set()
+        # Another instance removed one that was read.
+        self._lost = False
+        # Project folders last given. New files in them go in the folder's shard.
+        self._folders = []
+        # Threads of this instance. The lock file is for the other instances.
+        self._lock = threading.Lock()
+
+    def load(self, folders):
+        ''' Read the shards for the project folders. Returns dicts of fn: hls and fn: last used. '''
+        with self._lock, _FileLock(self.lock_fn):
+            self._folders = list(folders)
+            if not os.path.isfile(self.index_fn):
+                self._split_unsharded()
+            self._read_index()
+            self._loaded = set()
+            self._lost = False
+            hls = {}
+            access = {}
+            for name in self._shards_for(folders):
+                self._load_shard(name, hls, access)
+            return hls, access
+
+    def load_file(self, fn):
+        ''' Read the shard fn is in if that hasn't been done. Returns (hls, access) of the whole shard or None. '''
+        with self._lock:
+            if _snapshot_id(self.index_fn) != self._index_id:
+                # Another instance added shards. It's replaced atomically so no need to lock.
+                self._read_index()
+            name = self._find(fn)
+            if name is None or name in self._loaded:
+                return None
+
+        with self._lock, _FileLock(self.lock_fn):
+            if name in self._loaded or name not in self._index:
+                return None
+            hls = {}
+            access = {}
+            self._load_shard(name, hls, access)
+            return hls, access
+
+    def sync(self, records, access, compact=False, folders=None):
+        '''
+        Append this instance's changes and pick up the others', for the shards read so far and the ones records go to.
+        records are journal records from make_record(). access is the last used times to save with a snapshot. A
+        journal is folded into its snapshot when it gets long, or now if compact. folders are the open project folders,
+        None is the ones from last time.
+        Returns (full, others). full is {shard name: (hls, access)} of the shards another instance made a new snapshot of,
+        or that were not read before. If another instance removed shards that were read, the files in no shard now are
+        gone and full has ({}, {}) for None. others is the records the others added to the rest.
+        '''
+        with self._lock, _FileLock(self.lock_fn):
+            if folders is not None:
+                self._folders = list(folders)
+            self._refresh_index()
+
+            groups = {name: [] for name in self._loaded}
+            for record in records:
+                name = self._find(record['fn'])
+                if name is None:
+                    name = self._add_shard(record['fn'])
+                groups.setdefault(name, []).append(record)
+            shard_access = {name: {} for name in groups}
+            # Only remember the files in use, the rest come and go.
+            found = {}
+            for fn, at in access.items():
+                name = self._find(fn)
+                if name is not None:
+                    found[fn] = name
+                if name in shard_access:
+                    shard_access[name][fn] = at
+            self._found = found
+
+            full = {}
+            others = []
+            if self._lost:
+                full[None] = ({}, {})
+                self._lost = False
+            for name, shard_records in groups.items():
+                shard = self._get_shard(name)
+                shard_full, shard_others = shard.sync(shard_records, shard_access[name], compact)
+                self._loaded.add(name)
+                if shard_full is not None:
+                    full[name] = shard_full
+                others.extend(shard_others)
+                if shard.written is not None:
+                    self._set_stats(name, shard)
+
+            if self._index_changed:
+                self._write_index()
+            return full, others
+
+    def shard_of(self, fn):
+        ''' Name of the shard fn goes in, None if there isn't one yet. '''
+        with self._lock:
+            return self._find(fn)
+
+    def unread_files(self):
+        ''' Files in the shards not read, as of their last snapshots. '''
+        with self._lock:
+            return sum(info['files'] for name, info in self._index.items() if name not in self._loaded)
+
+    def evict_shards(self, max_files, max_age, now, read_files):
+        '''
+        Drop whole shards that haven't been read, least recently used first, while there are more than max_files
+        files in all and any not used for more than max_age sec. Either limit 0 is no limit. read_files is how many
+        files are in the ones read. Returns how many files are left in the others.
+        '''
+        with self._lock, _FileLock(self.lock_fn):
+            self._refresh_index()
+            unread = sorted((self._last_used(name), name) for name in self._index if name not in self._loaded)
+            left = sum(self._index[name]['files'] for _, name in unread)
+            dropped = 0
+            for used, name in unread:
+                too_many = max_files and read_files + left > max_files
+                too_old = max_age and used < now - max_age
+                if not (too_many or too_old):
+                    # The rest are newer.
+                    break
+                left -= self._index[name]['files']
+                self._drop_shard(name)
+                dropped += 1
+
+            if self._index_changed:
+                self._write_index()
+
+        if dropped > 0:
+            sc.debug(f'Evicted {dropped} least recently used shards from the store')
+        return left
+
+    def clear(self):
+        ''' Remove everything, for all instances. '''
+        with self._lock, _FileLock(self.lock_fn):
+            self._refresh_index()
+            for name in list(self._index):
+                self._drop_shard(name)
+            self._write_index()
+
+    def sizes(self):
+        ''' Number of shards and how many have been read, bytes on disk of their snapshots and journals. '''
+        with self._lock:
+            bases = [os.path.join(self.shard_dir, name) for name in self._index]
+            loaded = len(self._loaded)
+        return (len(bases), loaded, sum(_file_size(base + '.snapshot') for base in bases),
+                sum(_file_size(base + '.journal') for base in bases))
+
+    def _find(self, fn):
+        ''' Shard for fn: the one for its dir, else the deepest folder it's in. Lock must be held. '''
+        name = self._found.get(fn)
+        if name is not None:
+            return name
+
+        path = os.path.normcase(os.path.dirname(fn))
+        name = self._dir_roots.get(path)
+        while name is None:
+            name = self._folder_roots.get(path)
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+        return name
+
+    def _add_shard(self, fn):
+        ''' New shard for fn, for the deepest project folder it's in, else its dir. Lock must be held. '''
+        path = os.path.normcase(fn)
+        folders = [os.path.normpath(folder) for folder in self._folders]
+        folders = [folder for folder in folders if _is_under(path, _root_key(folder))]
+        if len(folders) > 0:
+            root, folder = max(folders, key=len), True
+        else:
+            root, folder = os.path.dirname(fn), False
+        name = _shard_name(root, folder)
+        self._index[name] = {'root': root, 'folder': folder, 'files': 0, 'used': 0}
+        self._add_root(name)
+        self._index_changed = True
+        return name
+
+    def _add_root(self, name):
+        info = self._index[name]
+        roots = self._folder_roots if info['folder'] else self._dir_roots
+        roots[_root_key(info['root'])] = name
+        self._found = {}
+
+    def _shards_for(self, folders):
+        ''' Shards with files in the folders. Lock must be held. '''
+        folders = [_root_key(folder) for folder in folders]
+        names = []
+        for name, info in self._index.items():
+            root = _root_key(info['root'])
+            # Under one of the folders, or a bigger project folder holding one.
+            if any(_is_under(root, folder) or (info['folder'] and _is_under(folder, root)) for folder in folders):
+                names.append(name)
+        return names
+
+    def _get_shard(self, name):
+        shard = self._shards.get(name)
+        if shard is None:
+            os.makedirs(self.shard_dir, exist_ok=True)
+            shard = _Shard(os.path.join(self.shard_dir, name))
+            self._shards[name] = shard
+        return shard
+
+    def _load_shard(self, name, hls, access):
+        ''' Read one shard into hls and access. Lock must be held. '''
+        shard_hls, shard_access = self._get_shard(name).read_all()
+        hls.update(shard_hls)
+        access.update(shard_access)
+        self._loaded.add(name)
+
+    def _drop_shard(self, name):
+        ''' Delete a shard's files and forget it. Lock must be held. '''
+        shard = self._get_shard(name)
+        for fn in [shard.snapshot_fn, shard.journal_fn]:
+            try:
+                os.remove(fn)
+            except FileNotFoundError:
+                pass
+        info = self._index.pop(name)
+        roots = self._folder_roots if info['folder'] else self._dir_roots
+        roots.pop(_root_key(info['root']), None)
+        self._found = {}
+        del self._shards[name]
+        self._loaded.discard(name)
+        self._index_changed = True
+
+    def _set_stats(self, name, shard):
+        ''' Index entry of a shard after its snapshot was written. Empty ones are removed. Lock must be held. '''
+        files, used = shard.written
+        shard.written = None
+        if files == 0 and shard.journal_count == 0:
+            self._drop_shard(name)
+        elif name in self._index:
+            self._index[name]['files'] = files
+            self._index[name]['used'] = used
+            self._index_changed = True
+
+    def _last_used(self, name):
+        ''' Last use of a shard. Includes changes since the snapshot and other instances' writes. '''
+        base = os.path.join(self.shard_dir, name)
+        mtimes = [(_snapshot_id(fn) or (0,))[0] // 1000000000 for fn in [base + '.snapshot', base + '.journal']]
+        return max([self._index[name]['used']] + mtimes)
+
+    def _read_index(self):
+        ''' Lock must be held or the index just checked for changes. '''
+        self._index = {}
+        self._index_id = _snapshot_id(self.index_fn)
+        if self._index_id is not None:
+            with open(self.index_fn, 'r') as fp:
+                self._index = json.load(fp)['shards']
+        self._index_changed = False
+        self._folder_roots = {}
+        self._dir_roots = {}
+        self._found = {}
+        for name in self._index:
+            self._add_root(name)
+        # Dropped by another instance.
+        for name in list(self._shards):
+            if name not in self._index:
+                del self._shards[name]
+                if name in self._loaded:
+                    self._loaded.discard(name)
+                    self._lost = True
+
+    def _refresh_index(self):
+        ''' Read the index again if another instance changed it. Lock must be held. '''
+        if _snapshot_id(self.index_fn) != self._index_id:
+            self._read_index()
+
+    def _write_index(self):
+        ''' Atomic replace of the index file. Lock must be held. '''
+        _atomic_write(self.index_fn, json.dumps({'version': _index_version, 'shards': self._index}, separators=(',', ':')))
+        self._index_id = _snapshot_id(self.index_fn)
+        self._index_changed = False
+
+    def _split_unsharded(self):
+        ''' One time split of an older store into shards. Its files are kept as .bak. Lock must be held. '''
+        old = self._unsharded
+        if not os.path.isfile(old.snapshot_fn) and os.path.isfile(self.legacy_fn):
+            self._migrate()
+        if not os.path.isfile(old.snapshot_fn):
+            return
+
+        hls, access = old.read_all()
+        groups = {}
+        for fn in hls:
+            name = self._find(fn)
+            if name is None:
+                name = self._add_shard(fn)
+            groups.setdefault(name, []).append(fn)
+        for name, fns in groups.items():
+            shard = self._get_shard(name)
+            shard.write_snapshot({fn: hls[fn] for fn in fns}, access)
+            self._set_stats(name, shard)
+        # The shards first, a crash before this just does it again.
+        self._write_index()
+
+        for fn in [old.snapshot_fn, old.journal_fn]:
+            if os.path.isfile(fn):
+                os.replace(fn, fn + '.bak')
+        sc.info(f'Split {old.snapshot_fn} into {len(groups)} shards in {self.shard_dir}')
+
+    def _migrate(self):
+        ''' One time conversion of the old single json file. It is kept as .bak. '''
+        with open(self.legacy_fn, 'r') as fp:
+            hls = json.load(fp)
+        self._unsharded.write_snapshot(hls, {})
+        os.replace(self.legacy_fn, self.legacy_fn + '.bak')
+        sc.info(f'Converted {self.legacy_fn} to {self._unsharded.snapshot_fn}')
+
+
+#-----------------------------------------------------------------------------------
+class _Shard:
+    ''' One snapshot plus its journal. The caller holds the locks. '''
+
+    def __init__(self, base):
+        self.snapshot_fn = base + '.snapshot'
+        self.journal_fn = base + '.journal'
+        # Records in the journal since the last compaction.
+        self.journal_count = 0
+        # Bytes of the journal read so far, and the snapshot they follow. See _snapshot_id().
+        self._journal_pos = 0
+        self._snapshot_id = None
+        # (files, last used) of the snapshot written last, until the index has them.
+        self.written = None
+
+    def sync(self, records, access, compact):
+        ''' See HighlightStore.sync(). full is (hls, access) of this shard or None. '''
+        full = None
+        others = []
+        if self._snapshot_id != _snapshot_id(self.snapshot_fn) or _file_size(self.journal_fn) < self._journal_pos:
+            full = self.read_all()
+        else:
+            others = self.read_tail()
+
+        if len(records) > 0:
+            self.append(records)
+            if full is not None:
+                # So it is what is on disk now.
+                for record in records:
+                    apply_record(full[0], full[1], record)
+
+        if compact or self.journal_count >= _compact_after:
+            # What is on disk now is everyone's changes merged.
+            hls, disk_access = full if full is not None else self.read_all()
+            for fn, at in access.items():
+                if fn in hls and at > disk_access.get(fn, 0):
+                    disk_access[fn] = at
+            self.write_snapshot(hls, disk_access)
+            self.truncate_journal()
+
+        return full, others
+
+    def read_all(self):
+        ''' Snapshot plus the whole journal. '''
+        hls = {}
+        access = {}
+        self._snapshot_id = _snapshot_id(self.snapshot_fn)
+        if os.path.isfile(self.snapshot_fn):
+            with open(self.snapshot_fn, 'r') as fp:
+                snapshot = json.load(fp)
+            hls = snapshot['files']
+            access = snapshot.get('access', {})
+
+        self.journal_count = 0
+        self._journal_pos = 0
+        for record in self.read_tail():
+            apply_record(hls, access, record)
+
+        # Older stores have no times. Start counting from now rather than evict the lot.
+        now = int(time.time())
+        for fn in hls:
+            access.setdefault(fn, now)
+        return hls, {fn: access[fn] for fn in hls}
+
+    def read_tail(self):
+        ''' Journal records after the ones read already. '''
+        if not os.path.isfile(self.journal_fn):
+            return []
+        with open(self.journal_fn, 'rb') as fp:
+            fp.seek(self._journal_pos)
+            data = fp.read()
+        self._journal_pos += len(data)
+
+        if len(data) > 0 and not data.endswith(b'\n'):
+            # Torn last line from a crash. Terminate it so the next record doesn't get glued onto it.
+            with open(self.journal_fn, 'ab') as fp:
+                fp.write(b'\n')
+            self._journal_pos += 1
+
+        records = []
+        for line in data.splitlines():
+            if len(line.strip()) == 0:
+                continue
+            self.journal_count += 1
+            try:
+                records.append(json.loads(line.decode('utf-8')))
+            except ValueError:
+                # It was never acknowledged so skip it.
+                sc.debug(f'Skipping bad journal record in {self.journal_fn}')
+        return records
+
+    def append(self, records):
+        ''' Add records to the journal in one write. '''
+        data = ''.join(json.dumps(record) + '\n' for record in records).encode('utf-8')
+        with open(self.journal_fn, 'ab') as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        self._journal_pos += len(data)
+        self.journal_count += len(records)
+
+    def truncate_journal(self):
+        ''' Empty the journal after a new snapshot. '''
+        # A crash before this just replays records already in the snapshot, which is harmless.
+        with open(self.journal_fn, 'w'):
+            pass
+        self.journal_count = 0
+        self._journal_pos = 0
+
+    def write_snapshot(self, hls, access):
+        ''' Atomic replace of the snapshot file. '''
+        snapshot = {'version': _store_version, 'files': hls, 'access': {fn: access[fn] for fn in hls if fn in access}}
+        _atomic_write(self.snapshot_fn, json.dumps(snapshot, separators=(',', ':')))
+        self._snapshot_id = _snapshot_id(self.snapshot_fn)
+        self.written = (len(hls), max(snapshot['access'].values(), default=0))
+
+
+#-----------------------------------------------------------------------------------
+class MatchCache:
+    '''
+    Scan results on disk so unchanged files are not rescanned when opened. One json file per source
+    file plus an index of entry sizes and last use for LRU eviction. The index is shared by the ST
+    instances so it's changed holding a lock file, on a fresh read. It's only a cache so errors just
+    make a miss.
+    '''
+
+    def __init__(self, store_fn):
+        ''' Lives in a dir next to store_fn. '''
+        base, _ = os.path.splitext(store_fn)
+        self.cache_dir = base + '.cache'
+        self.index_fn = os.path.join(self.cache_dir, 'index.json')
+        self.lock_fn = os.path.join(self.cache_dir, 'index.lock')
+        # Entry name: last used, for the hits since the index was last changed. Saved with the next change.
+        self._used = {}
+        self._lock = threading.Lock()
+
+    def get(self, fn, key):
+        '''
+        Cached hits for fn if they were made with key from file_key() and the content is the same. The content is
+        only read when the rest of the key matches. Returns dict of hl_index: [(start, end), ...] or None.
+        '''
+        name = _entry_name(fn)
+        try:
+            with open(os.path.join(self.cache_dir, name), 'r') as fp:
+                entry = json.load(fp)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            sc.debug(f'Dropping cached matches of {fn}: {e}')
+            self.drop(fn)
+            return None
+
+        try:
+            if entry['key'] != key or entry.get('content') != content_hash(fn):
+                return None
+        except OSError:
+            return None
+
+        with self._lock:
+            self._used[name] = time.time()
+        # Stored flat as [start, end, start, end, ...].
+        return {int(iind): list(zip(flat[0::2], flat[1::2])) for iind, flat in entry['hits'].items()}
+
+    def put(self, fn, key, hits, max_bytes):
+        ''' Remember hits for fn made with key. Evicts least recently used entries to stay under max_bytes. '''
+        # Each span is at least four chars, don't make the json to find out it's too big.
+        if 4 * sum(len(spans) for spans in hits.values()) > max_bytes:
+            return
+        try:
+            content = content_hash(fn)
+        except OSError:
+            return
+        flat = {iind: [pt for span in spans for pt in span] for iind, spans in hits.items()}
+        data = json.dumps({'key': key, 'content': content, 'hits': flat}, separators=(',', ':'))
+        if len(data) > max_bytes:
+            return
+
+        name = _entry_name(fn)
+
+        def change(index):
+            _atomic_write(os.path.join(self.cache_dir, name), data)
+            index[name] = [len(data), time.time()]
+            total = sum(size for size, _ in index.values())
+            for old in sorted(index, key=lambda n: index[n][1]):
+                if total <= max_bytes:
+                    break
+                total -= index[old][0]
+                self._remove(index, old)
+
+        self._change(change, fn)
+
+    def drop(self, fn):
+        ''' Forget fn, its tokens changed. '''
+        name = _entry_name(fn)
+        if os.path.exists(os.path.join(self.cache_dir, name)):
+            self._change(lambda index: self._remove(index, name), fn)
+
+    def clear(self):
+        ''' Forget everything. '''
+        def change(index):
+            for name in list(index):
+                self._remove(index, name)
+
+        self._change(change, self.cache_dir)
+
+    def sizes(self):
+        ''' Number of entries and their total bytes. '''
+        index = self._read_index()
+        return len(index), sum(size for size, _ in index.values())
+
+    def _change(self, change, fn):
+        ''' Run change(index) on the index read now, then save it with the last used times. '''
+        with self._lock:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with _FileLock(self.lock_fn):
+                    index = self._read_index()
+                    for name, at in self._used.items():
+                        if name in index:
+                            index[name][1] = max(index[name][1], at)
+                    self._used = {}
+                    change(index)
+                    _atomic_write(self.index_fn, json.dumps(index))
+            except OSError as e:
+                sc.debug(f'Error caching matches of {fn}: {e}')
+
+    def _read_index(self):
+        try:
+            with open(self.index_fn, 'r') as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def _remove(self, index, name):
+        index.pop(name, None)
+        try:
+            os.remove(os.path.join(self.cache_dir, name))
+        except OSError:
+            pass
+
+
+#-----------------------------------------------------------------------------------
+class _FileLock:
+    ''' Exclusive lock across processes, held on a file that is never written. Blocks until it is free. '''
+
+    def __init__(self, fn):
+        self.fn = fn
+        self._fp = None
+
+    def __enter__(self):
+        self._fp = open(self.fn, 'a')
+        try:
+            if os.name == 'nt':
+                # Locks the first byte. Gives up with OSError after 10 tries a sec apart.
+                self._fp.seek(0)
+                msvcrt.locking(self._fp.fileno(), msvcrt.LK_LOCK, 1)
+            else:
+                fcntl.flock(self._fp.fileno(), fcntl.LOCK_EX)
+        except Exception:
+            self._fp.close()
+            raise
+        return self
+
+    def __exit__(self, *args):
+        try:
+            if os.name == 'nt':
+                self._fp.seek(0)
+                msvcrt.locking(self._fp.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._fp.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._fp.close()
+
+
+#-----------------------------------------------------------------------------------
+def make_record(fn, hls, at=None):
+    ''' Journal record for one entry. hls None or empty removes it. at is when it was last used. '''
+    if hls:
+        return {'fn': fn, 'hls': hls, 'at': at if at is not None else int(time.time())}
+    return {'fn': fn, 'hls': None}
+
+
+#-----------------------------------------------------------------------------------
+def apply_record(hls, access, record):
+    ''' Apply one journal record to hls and access. '''
+    if record['hls']:
+        hls[record['fn']] = record['hls']
+        if 'at' in record:
+            access[record['fn']] = record['at']
+    else:
+        hls.pop(record['fn'], None)
+        access.pop(record['fn'], None)
+
+
+#-----------------------------------------------------------------------------------
+def file_key(fn, hl_vals):
+    ''' Cheap identity of fn and the tokens scanned for. The content is checked with content_hash() after this matches. '''
+    stat = os.stat(fn)
+    tokens = hashlib.sha1(json.dumps(hl_vals, sort_keys=True).encode()).hexdigest()
+    return [fn, stat.st_size, stat.st_mtime_ns, tokens]
+
+
+#-----------------------------------------------------------------------------------
+def content_hash(fn):
+    ''' Hash of the content of fn. Reads the whole file so call from a worker. '''
+    content = hashlib.sha1()
+    with open(fn, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            content.update(block)
+    return content.hexdigest()
+
+
+#-----------------------------------------------------------------------------------
+def pick_evictions(access, max_files, max_age, now):
+    '''
+    Which files to drop so there are at most max_files and none unused for more than max_age sec.
+    access is a list of (last used, fn). Either limit 0 is no limit. Returns the fns, oldest first.
+    '''
+    access = sorted(access)
+    count = len(access) - max_files if max_files and len(access) > max_files else 0
+    if max_age:
+        # Everything before the first one recent enough has to go too.
+        count = max(count, bisect.bisect_left(access, (now - max_age, '')))
+    return [fn for _, fn in access[:count]]
+
+
+#-----------------------------------------------------------------------------------
+def find_missing(fns):
+    '''
+    Check which of fns are gone. Blocks so call from a worker thread.
+    Volumes that are missing or don't answer in time are skipped rather than waited on, so files on
+    an unplugged drive or a dead share are not reported - they may well be back next time.
+    '''
+    # Only the background check uses a pool, the plugin doesn't load this at startup.
+    import concurrent.futures
+
+    missing = []
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=_check_workers)
+    try:
+        # Check each volume once first. A dead share then costs one timeout instead of one per file.
+        volumes = {}
+        for fn in fns:
+            volumes.setdefault(_volume(fn), []).append(fn)
+        vol_checks = {pool.submit(os.path.isdir, vol): vol for vol in volumes}
+        done, _ = concurrent.futures.wait(vol_checks, timeout=_check_timeout)
+        live = [vol_checks[f] for f in done if f.result()]
+
+        # Then the files on the live ones. Each gets _check_timeout of worker time.
+        file_checks = {pool.submit(os.path.exists, fn): fn for vol in live for fn in volumes[vol]}
+        if len(file_checks) > 0:
+            timeout = _check_timeout * math.ceil(len(file_checks) / _check_workers)
+            done, _ = concurrent.futures.wait(file_checks, timeout=timeout)
+            missing = [file_checks[f] for f in done if not f.result()]
+    finally:
+        # Don't wait for any hung checks.
+        pool.shutdown(wait=False)
+
+    return missing
+
+
+#-----------------------------------------------------------------------------------
+def _shard_name(root, folder):
+    ''' File name for the shard of root. Readable part plus a hash, a folder and a dir shard can have the same root. '''
+    label = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in os.path.basename(root.rstrip('\\/'))) or 'root'
+    key = ('folder:' if folder else 'dir:') + _root_key(root)
+    return f'{label}_{hashlib.sha1(key.encode()).hexdigest()[:12]}'
+
+
+#-----------------------------------------------------------------------------------
+def _root_key(root):
+    ''' Normalized dir for comparing with other paths. '''
+    return os.path.normcase(os.path.normpath(root))
+
+
+#-----------------------------------------------------------------------------------
+def _is_under(path, folder):
+    ''' path is folder or in it. Both normalized. '''
+    folder = folder.rstrip('\\/')
+    return path == folder or path.startswith(folder + os.sep)
+
+
+#-----------------------------------------------------------------------------------
+def _entry_name(fn):
+    ''' Cache file name for fn. '''
+    return hashlib.sha1(fn.encode()).hexdigest() + '.json'
+
+
+#-----------------------------------------------------------------------------------
+def _snapshot_id(fn):
+    ''' Changes when fn is replaced. None if there is no fn. '''
+    try:
+        stat = os.stat(fn)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+#-----------------------------------------------------------------------------------
+def _file_size(fn):
+    ''' Bytes, 0 if there is no fn. '''
+    try:
+        return os.path.getsize(fn)
+    except OSError:
+        return 0
+
+
+#-----------------------------------------------------------------------------------
+def _atomic_write(fn, data):
+    ''' Write to a temp file then swap it in. '''
+    tmp_fn = fn + '.tmp'
+    with open(tmp_fn, 'w') as fp:
+        fp.write(data)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_fn, fn)
+
+
+#-----------------------------------------------------------------------------------
+def _volume(fn):
+    ''' Drive, share or top two dirs that fn lives on. '''
+    drive, rest = os.path.splitdrive(fn)
+    if len(drive) > 0:
+        return drive + os.sep
+    parts = rest.split(os.sep)
+    return os.sep.join(parts[:3]) if len(parts) > 3 else os.sep